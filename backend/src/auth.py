@@ -3,28 +3,40 @@
 This module provides functionality for user authentication and authorization,
 including password hashing, JWT token generation, and role-based access control.
 """
-import os
+import uuid
 from datetime import datetime, timedelta
 
 import jwt
-from dotenv import load_dotenv
 from fastapi import FastAPI, HTTPException, Request, Depends
 from fastapi.security import OAuth2PasswordBearer
 from passlib.context import CryptContext
 from .services.database import get_db
 from .services import crud
 from .shared.auth import authenticate_user, authorize_roles, UserWithoutRole, TokenSchema
+from .shared.revocation import revocation_cache
+from .shared.admission import setup_admission_control
+from .shared.profiling import setup_profiling
+from .shared.tracing import setup_tracing
 from .shared.metrics import setup_metrics
-
-load_dotenv()
-
-SECRET_KEY = os.getenv("SECRET_KEY")
-ALGORITHM = os.getenv("ALGORITHM")
-ACCESS_TOKEN_EXPIRE_MINUTES = float(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES"))
-
-app = FastAPI()
+from .shared.lifecycle import lifespan, setup_readiness
+from .shared.settings import get_settings
+
+settings = get_settings()
+SECRET_KEY = settings.secret_key
+ALGORITHM = settings.algorithm
+ACCESS_TOKEN_EXPIRE_MINUTES = settings.access_token_expire_minutes
+
+app = FastAPI(lifespan=lifespan)
+# Setup readiness probe
+setup_readiness(app)
+# Setup on-demand request profiling
+setup_profiling(app)
+# Setup rate limiting and load shedding
+setup_admission_control(app)
 # Setup Prometheus metrics
 setup_metrics(app)
+# Setup distributed tracing
+setup_tracing(app)
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
@@ -64,8 +76,10 @@ def create_jwt_token(data: dict, expires_delta: timedelta = None) -> str:
         The encoded JWT token
     """
     to_encode = data.copy()
-    expire = datetime.utcnow() + (expires_delta if expires_delta else timedelta(minutes=15))
-    to_encode.update({"exp": expire})
+    now = datetime.utcnow()
+    expire = now + (expires_delta if expires_delta else timedelta(minutes=15))
+    # jti identifies the token for revocation, iat is compared to per-user cutoffs
+    to_encode.update({"exp": expire, "iat": (now - datetime(1970, 1, 1)).total_seconds(), "jti": uuid.uuid4().hex})
     return jwt.encode(to_encode, SECRET_KEY.encode(), ALGORITHM)
 
 # Health check endpoint
@@ -116,6 +130,53 @@ async def login(user: UserWithoutRole, db = Depends(get_db)) -> dict:
     )
     return {"token": token, "token_type": "bearer"}
 
+# User logout
+@app.post("/logout/")
+@authenticate_user
+async def logout(request: Request, db = Depends(get_db)) -> dict:
+    """Revoke the token used for this request.
+
+    Args:
+        request: The request object containing the decoded token
+
+    Returns:
+        A message confirming the token was revoked
+
+    Raises:
+        HTTPException: If the token has no id and cannot be revoked on its own
+    """
+    jti = request.state.token.get("jti")
+    if jti is None:
+        raise HTTPException(status_code=400, detail="Token cannot be revoked individually")
+    expires_at = datetime.utcfromtimestamp(request.state.token["exp"])
+    crud.revoke_token(db, jti, expires_at)
+    revocation_cache.revoke_token(jti, request.state.token["exp"])
+    return {"message": "Logged out successfully"}
+
+# Revoke every token of a user
+@app.post("/revoke/{username}")
+@authenticate_user
+@authorize_roles("admin", "superadmin")
+async def revoke_user_tokens(username: str, request: Request, db = Depends(get_db)) -> dict:
+    """Revoke all tokens issued to a user until now.
+
+    Args:
+        username: The user whose tokens are revoked
+        request: The request object (used by the decorators)
+
+    Returns:
+        A message confirming the revocation
+
+    Raises:
+        HTTPException: If the user does not exist
+    """
+    if crud.get_user_by_username(db, username) is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    now = datetime.utcnow()
+    crud.revoke_user_tokens(db, username, now)
+    revocation_cache.revoke_user(username, (now - datetime(1970, 1, 1)).total_seconds())
+    return {"message": f"Tokens of {username} revoked"}
+
 # This is an example of a protected endpoint that needs authentication
 @app.get("/test/auth/protected/")
 @authenticate_user
@@ -10,13 +10,25 @@ from pydantic import BaseModel
 
 from .services.database import get_db
 from .services import crud
+from .shared.admission import setup_admission_control
+from .shared.profiling import setup_profiling
+from .shared.tracing import setup_tracing
+from .shared.lifecycle import lifespan, setup_readiness
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Initialize FastAPI application
-app = FastAPI(title="Order Service")
+app = FastAPI(title="Order Service", lifespan=lifespan)
+# Setup readiness probe
+setup_readiness(app)
+# Setup on-demand request profiling
+setup_profiling(app)
+# Setup rate limiting and load shedding
+setup_admission_control(app)
+# Setup distributed tracing
+setup_tracing(app)
 
 
 class BaseConfig:
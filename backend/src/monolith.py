@@ -0,0 +1,58 @@
+"""All services in one process.
+
+Mounts the auth, product, orders, payment and database applications under
+the path prefixes the API gateway routes to them (``kong.yml``), so clients
+use the same URLs without the gateway hop. The services share what is
+already process-wide: the SQLAlchemy engine and its pool, the Prometheus
+registry, the token revocation cache and the admission limits.
+
+Meant for small deployments and integration benchmarks; each service can
+still be run on its own as before.
+
+    uvicorn src.monolith:app --host 0.0.0.0 --port 8000
+"""
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI
+
+from . import auth, database, orders, payment, product
+from .shared.lifecycle import lifespan, setup_readiness
+from .shared.metrics import metrics
+
+SERVICES = {
+    "/auth": auth.app,
+    "/products": product.app,
+    "/orders": orders.app,
+    "/payment": payment.app,
+    "/database": database.app,
+}
+
+
+@asynccontextmanager
+async def monolith_lifespan(app: FastAPI):
+    """Run the startup and shutdown of the mounted services.
+
+    Mounted applications do not get lifespan events of their own. The shared
+    lifespan is entered once, outermost, so the payment workers stop before
+    the engine is disposed and the revocation cache is stopped.
+    """
+    async with lifespan(app), payment.payment_workers(payment.app):
+        yield
+
+
+app = FastAPI(title="Backend", lifespan=monolith_lifespan)
+# Setup readiness probe
+setup_readiness(app)
+# Prometheus metrics of all services, from the shared registry
+app.add_api_route("/metrics", metrics, methods=["GET"], include_in_schema=False)
+
+
+# Health check endpoint
+@app.get("/health")
+def health_check():
+    """Health check endpoint to verify service status."""
+    return {"status": "healthy"}
+
+
+for prefix, service in SERVICES.items():
+    app.mount(prefix, service)
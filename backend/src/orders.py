@@ -3,13 +3,18 @@
 This module provides functionality for creating and managing orders.
 """
 import logging
-from typing import List
+from datetime import datetime
+from typing import List, Optional
 
-from fastapi import FastAPI, HTTPException, Depends, Request
+from fastapi import FastAPI, HTTPException, Depends, Query, Request
 from pydantic import BaseModel
 
 from .services.database import get_db
 from .services import crud
+from .shared.admission import latency_target, setup_admission_control
+from .shared.profiling import setup_profiling
+from .shared.tracing import setup_tracing
+from .shared.lifecycle import lifespan, setup_readiness
 from .shared.metrics import setup_metrics
 from .shared.auth import authenticate_user, authorize_roles
 
@@ -18,9 +23,17 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Initialize FastAPI application
-app = FastAPI(title="Order Service")
+app = FastAPI(title="Order Service", lifespan=lifespan)
+# Setup readiness probe
+setup_readiness(app)
+# Setup on-demand request profiling
+setup_profiling(app)
+# Setup rate limiting and load shedding
+setup_admission_control(app)
 # Setup Prometheus metrics
 setup_metrics(app)
+# Setup distributed tracing
+setup_tracing(app)
 
 
 class BaseConfig:
@@ -40,6 +53,7 @@ class OrderResponse(BaseModel):
     user_id: int
     product_id: int
     status: str
+    created_at: Optional[datetime] = None
 
     class Config(BaseConfig):
         """Pydantic configuration."""
@@ -82,16 +96,74 @@ async def create_order(order: OrderRequest, request: Request, db = Depends(get_d
 @app.get("/", response_model=List[OrderResponse])
 @authenticate_user
 @authorize_roles("admin", "superadmin")
-async def get_orders(request: Request, db = Depends(get_db)):
-    """Get a list of all orders. Requires admin privileges."""
+async def get_orders(
+    request: Request,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+    history: bool = False,
+    db = Depends(get_db)
+):
+    """Get a list of orders, newest first. Requires admin privileges.
+
+    Only recent orders are listed unless ``history`` is set, so the query
+    does not scan the archived partitions.
+    """
     try:
-        orders = crud.get_orders(db)
+        orders = crud.get_orders(db, skip=skip, limit=limit, history=history)
         return orders
     except Exception as e:
         logger.error("Error retrieving orders: %s", str(e))
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}") from e
 
 
+class OrderStats(BaseModel):
+    """Aggregated orders for one product, user or status."""
+    key: str
+    orders: int
+    revenue: float
+
+
+STATS_DIMENSIONS = {"products": "product", "users": "user", "status": "status"}
+
+
+@app.get("/stats/{dimension}", response_model=List[OrderStats])
+@authenticate_user
+@authorize_roles("admin", "superadmin")
+async def get_order_stats(
+    dimension: str,
+    request: Request,
+    limit: int = Query(10, ge=1, le=1000),
+    order_by: str = Query("revenue", pattern="^(revenue|orders)$"),
+    db = Depends(get_db)
+):
+    """Get order counts and order value per product, user or status. Requires admin privileges.
+
+    Served from incrementally maintained counters, so the cost does not grow
+    with the number of orders. ``users`` ordered by revenue gives the top buyers.
+    """
+    if dimension not in STATS_DIMENSIONS:
+        raise HTTPException(status_code=404, detail="Unknown statistics dimension")
+    try:
+        return crud.get_order_aggregates(db, STATS_DIMENSIONS[dimension], limit=limit, order_by=order_by)
+    except Exception as e:
+        logger.error("Error retrieving order statistics: %s", str(e))
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}") from e
+
+
+@app.post("/stats/rebuild")
+@latency_target(None)
+@authenticate_user
+@authorize_roles("admin", "superadmin")
+async def rebuild_order_stats(request: Request, db = Depends(get_db)):
+    """Recompute the order counters from the orders table. Requires admin privileges."""
+    try:
+        crud.rebuild_order_aggregates(db)
+        return {"message": "Order statistics rebuilt"}
+    except Exception as e:
+        logger.error("Error rebuilding order statistics: %s", str(e))
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}") from e
+
+
 @app.get("/{order_id}", response_model=OrderResponse)
 @authenticate_user
 async def get_order(order_id: int, request: Request, db = Depends(get_db)):
@@ -118,8 +190,11 @@ async def get_order(order_id: int, request: Request, db = Depends(get_db)):
 
 @app.get("/user/{username}", response_model=List[OrderResponse])
 @authenticate_user
-async def get_user_orders(username: str, request: Request, db = Depends(get_db)):
-    """Get all orders for a specific user. Users can only view their own orders unless they are admin."""
+async def get_user_orders(username: str, request: Request, history: bool = False, db = Depends(get_db)):
+    """Get the recent orders of a specific user, or all of them with ``history``.
+
+    Users can only view their own orders unless they are admin.
+    """
     try:
         # Get the authenticated user
         auth_user = crud.get_user_by_username(db, username=request.state.user["username"])
@@ -133,7 +208,7 @@ async def get_user_orders(username: str, request: Request, db = Depends(get_db))
         if auth_user.role not in ["admin", "superadmin"] and auth_user.username != username:
             raise HTTPException(status_code=403, detail="Not authorized to view these orders")
             
-        orders = crud.get_user_orders(db, user_id=target_user.id)
+        orders = crud.get_user_orders(db, user_id=target_user.id, history=history)
         return orders
     except HTTPException:
         raise
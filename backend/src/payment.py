@@ -1,32 +1,169 @@
 """Payment service."""
+import json
+import logging
+from contextlib import asynccontextmanager
 
 from fastapi import FastAPI, HTTPException, Depends, Request
+from fastapi.concurrency import run_in_threadpool
 from .services.database import get_db
 from .services import crud
+from .services.payments import processor, verify_webhook
 from .shared.auth import authenticate_user
+from .shared.admission import setup_admission_control
+from .shared.profiling import setup_profiling
+from .shared.tracing import setup_tracing
+from .shared.metrics import setup_metrics
+from .shared.lifecycle import lifespan, setup_readiness
+from .shared.settings import get_settings
 from pydantic import BaseModel
+from sqlalchemy.exc import IntegrityError
 
-app = FastAPI()
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def payment_workers(app: FastAPI):
+    """Run the payment workers; they need the shared lifespan around them."""
+    await processor.start()
+    yield
+    await processor.stop()
+
+
+@asynccontextmanager
+async def payment_lifespan(app: FastAPI):
+    """Run the shared startup, then the payment workers."""
+    async with lifespan(app), payment_workers(app):
+        yield
+
+
+app = FastAPI(lifespan=payment_lifespan)
+# Setup readiness probe
+setup_readiness(app)
+# Setup on-demand request profiling
+setup_profiling(app)
+# Setup rate limiting and load shedding
+setup_admission_control(app)
+# Setup Prometheus metrics
+setup_metrics(app)
+# Setup distributed tracing
+setup_tracing(app)
 
 class PaymentRequest(BaseModel):
     order_id: int
 
-@app.post("/")
+class PaymentConfirmation(BaseModel):
+    reference: str
+    status: str
+    error: str = None
+
+def payment_to_dict(payment) -> dict:
+    """Serialize a payment for the API."""
+    return {
+        "payment_id": payment.id,
+        "order_id": payment.order_id,
+        "amount": payment.amount,
+        "status": payment.status,
+        "attempt": payment.attempt,
+        "error": payment.error,
+    }
+
+# Health check endpoint
+@app.get("/health")
+def health_check():
+    """Health check endpoint to verify service status."""
+    return {"status": "healthy"}
+
+@app.post("/", status_code=202)
 @authenticate_user
 async def pay_order(payment: PaymentRequest, request: Request, db = Depends(get_db)):
-    """Pay for an order."""
+    """Start paying for an order.
+
+    The payment is charged in the background; poll ``GET /{payment_id}`` for
+    the outcome.
+    """
     try:
-        order = crud.get_order(db, order_id=payment.order_id)
+        order = await run_in_threadpool(crud.get_order, db, order_id=payment.order_id)
         if not order:
             raise HTTPException(status_code=404, detail="Order not found")
-        user = crud.get_user_by_username(db, username=request.state.user["username"])
+        user = await run_in_threadpool(crud.get_user_by_username, db, username=request.state.user["username"])
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
         if user.id != order.user_id:
             raise HTTPException(status_code=403, detail="User is not the owner of the order")
-        status = crud.set_order_status(db, order_id=payment.order_id, status="paid")
-        if not status:
-            raise HTTPException(status_code=404, detail="Order not found")
-        return {"message": "Order paid successfully"}
+        existing = await run_in_threadpool(crud.get_payment_by_order, db, order_id=order.id)
+        if existing and existing.status == "succeeded":
+            raise HTTPException(status_code=409, detail="Order already paid")
+        if existing and existing.status in ("pending", "processing"):
+            return payment_to_dict(existing)
+        if processor.full():
+            raise HTTPException(status_code=503, detail="Too many payments in progress", headers={"Retry-After": "1"})
+        if existing:
+            # A new attempt, so that the provider does not replay the decline
+            db_payment = await run_in_threadpool(crud.retry_payment, db, existing.id)
+            if not db_payment:
+                # Picked up by a concurrent request in the meantime
+                return payment_to_dict(await run_in_threadpool(crud.get_payment, db, existing.id))
+        else:
+            try:
+                db_payment = await run_in_threadpool(crud.create_payment, db, order_id=order.id, amount=order.amount)
+            except IntegrityError:
+                # Created by a concurrent request in the meantime
+                return payment_to_dict(await run_in_threadpool(crud.get_payment_by_order, db, order_id=order.id))
+        processor.submit(db_payment.id)
+        return payment_to_dict(db_payment)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Error creating payment: %s", str(e))
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}") from e
+
+@app.post("/webhook")
+async def confirm_payment(request: Request, db = Depends(get_db)):
+    """Record a payment outcome confirmed later by the provider.
+
+    The body must be signed with ``PAYMENT_WEBHOOK_SECRET`` in ``X-Signature``.
+    """
+    body = await request.body()
+    if not verify_webhook(get_settings().payment_webhook_secret, body, request.headers.get("X-Signature")):
+        raise HTTPException(status_code=403, detail="Invalid signature")
+    try:
+        confirmation = PaymentConfirmation(**json.loads(body))
+    except Exception as e:
+        raise HTTPException(status_code=400, detail="Invalid confirmation") from e
+    if confirmation.status not in ("succeeded", "failed"):
+        raise HTTPException(status_code=400, detail="Invalid payment status")
+    try:
+        db_payment = await run_in_threadpool(crud.get_payment_by_reference, db, confirmation.reference)
+        if not db_payment:
+            raise HTTPException(status_code=404, detail="Payment not found")
+        if db_payment.status in ("succeeded", "failed"):
+            return payment_to_dict(db_payment)
+        db_payment = await run_in_threadpool(
+            crud.set_payment_status, db, db_payment.id, confirmation.status, error=confirmation.error
+        )
+        return payment_to_dict(db_payment)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Error confirming payment: %s", str(e))
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}") from e
+
+@app.get("/{payment_id}")
+@authenticate_user
+async def get_payment(payment_id: int, request: Request, db = Depends(get_db)):
+    """Return the status of a payment of the authenticated user."""
+    try:
+        db_payment = await run_in_threadpool(crud.get_payment, db, payment_id)
+        if not db_payment:
+            raise HTTPException(status_code=404, detail="Payment not found")
+        order = await run_in_threadpool(crud.get_order, db, order_id=db_payment.order_id)
+        user = await run_in_threadpool(crud.get_user_by_username, db, username=request.state.user["username"])
+        if not order or not user or user.id != order.user_id:
+            raise HTTPException(status_code=404, detail="Payment not found")
+        return payment_to_dict(db_payment)
+    except HTTPException:
+        raise
     except Exception as e:
+        logger.error("Error retrieving payment: %s", str(e))
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}") from e
@@ -7,10 +7,15 @@ import logging
 from datetime import datetime
 
 from fastapi import FastAPI, HTTPException, Query, Depends, Request
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 
-from .services.database import get_db
-from .services import crud
+from .services.database import get_db, create_session
+from .services import crud, importer
+from .shared.admission import latency_target, setup_admission_control
+from .shared.profiling import setup_profiling
+from .shared.tracing import setup_tracing
+from .shared.lifecycle import lifespan, setup_readiness
 from .shared.metrics import setup_metrics
 from .shared.auth import authenticate_user, authorize_roles
 
@@ -19,9 +24,17 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Initialize FastAPI application
-app = FastAPI(title="Product Service")
+app = FastAPI(title="Product Service", lifespan=lifespan)
+# Setup readiness probe
+setup_readiness(app)
+# Setup on-demand request profiling
+setup_profiling(app)
+# Setup rate limiting and load shedding
+setup_admission_control(app)
 # Setup Prometheus metrics
 setup_metrics(app)
+# Setup distributed tracing
+setup_tracing(app)
 
 
 class BaseConfig:
@@ -104,6 +117,62 @@ async def create_product(product: ProductResponse, request: Request, db = Depend
         logger.error("Error creating product: %s", str(e))
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}") from e
 
+IMPORT_FORMATS = {
+    "application/x-ndjson": importer.iter_ndjson,
+    "application/jsonl": importer.iter_ndjson,
+    "text/csv": importer.iter_csv,
+}
+# PostgreSQL limits a statement to 65535 bind parameters (6 per product)
+MAX_IMPORT_BATCH_SIZE = 10000
+
+
+@app.post("/import")
+@latency_target(None)
+@authenticate_user
+@authorize_roles("admin", "superadmin")
+async def import_products(request: Request, batch_size: int = Query(5000, ge=1, le=MAX_IMPORT_BATCH_SIZE)):
+    """Bulk import products from a streamed NDJSON or CSV body.
+
+    Rows are validated as the body arrives and upserted by id in batches,
+    so the upload is never buffered whole. Progress is logged per batch and
+    returned as one report per batch.
+    """
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    parse = IMPORT_FORMATS.get(content_type)
+    if parse is None:
+        raise HTTPException(
+            status_code=415,
+            detail=f"Unsupported content type, expected one of: {', '.join(IMPORT_FORMATS)}"
+        )
+
+    reports = []
+    imported = failed = 0
+    db = create_session()
+    try:
+        async for rows, errors in importer.iter_batches(parse(request.stream()), batch_size):
+            report = {"batch": len(reports) + 1, "rows": len(rows), "imported": 0, "errors": [
+                {"line": error.line, "error": error.message} for error in errors
+            ]}
+            failed += len(errors)
+            if rows:
+                try:
+                    report["imported"] = await run_in_threadpool(crud.upsert_products, db, rows)
+                    imported += report["imported"]
+                except Exception as e:
+                    db.rollback()
+                    logger.error("Error importing batch %d: %s", report["batch"], str(e))
+                    failed += len(rows)
+                    report["errors"].append({"error": f"Batch failed: {str(e)}"})
+            logger.info(
+                "Product import batch %d: %d imported, %d errors",
+                report["batch"], report["imported"], len(report["errors"])
+            )
+            reports.append(report)
+    finally:
+        db.close()
+    return {"imported": imported, "failed": failed, "batches": reports}
+
+
 @app.get("/user/{username}")
 @authenticate_user
 async def get_user_products(
@@ -119,7 +188,7 @@ async def get_user_products(
         if user.username != request.state.user["username"]:
             raise HTTPException(status_code=403, detail="User is not the owner of the products")
         # Get user's orders
-        orders = crud.get_user_orders(db, user_id=user.id)
+        orders = crud.get_user_orders(db, user_id=user.id, history=True)
         # Extract products from orders
         products = [order["product_id"] for order in orders]
         return products
@@ -0,0 +1,242 @@
+"""Partition maintenance and archival of the ``orders`` table (PostgreSQL).
+
+``orders`` is range-partitioned by ``created_at`` into monthly partitions
+named ``orders_YYYY_MM``, plus ``orders_default`` for rows outside of them.
+The table is created with the partitions of the current and the next
+``ORDERS_PARTITION_MONTHS_AHEAD`` months, and the job below keeps creating
+them ahead. Default ``crud`` queries only read the last ``ORDERS_HOT_DAYS``
+days, so PostgreSQL prunes the older partitions.
+
+Once a whole month is older than ``ORDERS_ARCHIVE_AFTER_DAYS`` and none of
+its orders has a payment in flight, its partition is archived. Only settled
+orders are archived: orders still ``created`` (never paid) by then are
+marked ``abandoned`` first, which settles them. Then the partition is:
+
+* exported as gzip-compressed JSON lines to ``ORDERS_ARCHIVE_DIR`` (if set);
+* then dropped if ``ORDERS_ARCHIVE_DROP`` is set (which requires the export),
+  or otherwise kept attached, moved to ``ORDERS_COLD_TABLESPACE`` (if set)
+  and marked as archived. Kept partitions still answer ``history`` queries.
+
+Run daily, e.g. from a cron job::
+
+    python -m src.services.archival
+"""
+import argparse
+import gzip
+import json
+import logging
+import os
+import re
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from .database import create_session
+from ..shared.settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+ARCHIVED_COMMENT = "archived"
+UNSETTLED_STATUS = "created"
+ABANDONED_STATUS = "abandoned"
+PARTITION_NAME = re.compile(r"^orders_(\d{4})_(\d{2})$")
+
+
+def _add_months(month: date, count: int) -> date:
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    """Name of the partition holding the orders of ``month``."""
+    return f"orders_{month:%Y_%m}"
+
+
+def _upcoming_months(months_ahead: int = None) -> list:
+    if months_ahead is None:
+        months_ahead = get_settings().orders_partition_months_ahead
+    first = date.today().replace(day=1)
+    return [_add_months(first, offset) for offset in range(months_ahead + 1)]
+
+
+def _bounds(month: date) -> str:
+    return f"('{month.isoformat()}') TO ('{_add_months(month, 1).isoformat()}')"
+
+
+def create_initial_partitions(target, connection, **kw) -> None:
+    """``after_create`` listener of ``orders``: the default partition and the upcoming months."""
+    if connection.dialect.name != "postgresql":
+        return
+    connection.execute(text("CREATE TABLE IF NOT EXISTS orders_default PARTITION OF orders DEFAULT"))
+    for month in _upcoming_months():
+        connection.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {partition_name(month)} PARTITION OF orders FOR VALUES FROM {_bounds(month)}"
+        ))
+
+
+def _has_default_partition(db: Session) -> bool:
+    return db.execute(text("SELECT to_regclass('orders_default') IS NOT NULL")).scalar()
+
+
+def ensure_order_partitions(db: Session, months_ahead: int = None) -> list:
+    """Create the partitions of the current month and the next ``months_ahead``.
+
+    Orders of a missing month wait in the default partition, which would
+    make creating the partition fail. They are moved to the new partition
+    while the default partition is detached. Each partition is created in
+    its own transaction. Returns the names of the partitions created.
+    """
+    existing = {name for name, _ in list_order_partitions(db)}
+    has_default = _has_default_partition(db)
+    created = []
+    for month in _upcoming_months(months_ahead):
+        name = partition_name(month)
+        if name in existing:
+            continue
+        start, end = month.isoformat(), _add_months(month, 1).isoformat()
+        in_range = f"created_at >= '{start}' AND created_at < '{end}'"
+        waiting = has_default and db.execute(text(
+            f"SELECT EXISTS (SELECT 1 FROM orders_default WHERE {in_range})"
+        )).scalar()
+        if waiting:
+            db.execute(text("ALTER TABLE orders DETACH PARTITION orders_default"))
+        db.execute(text(f"CREATE TABLE {name} PARTITION OF orders FOR VALUES FROM {_bounds(month)}"))
+        if waiting:
+            moved = db.execute(text(f"INSERT INTO {name} SELECT * FROM orders_default WHERE {in_range}")).rowcount
+            db.execute(text(f"DELETE FROM orders_default WHERE {in_range}"))
+            db.execute(text("ALTER TABLE orders ATTACH PARTITION orders_default DEFAULT"))
+            logger.info("Moved %s orders from orders_default to %s", moved, name)
+        db.commit()
+        created.append(name)
+    return created
+
+
+def list_order_partitions(db: Session) -> list:
+    """Return ``(name, comment)`` for every monthly partition of ``orders``."""
+    rows = db.execute(text(
+        "SELECT c.relname, obj_description(c.oid, 'pg_class') "
+        "FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = 'orders'::regclass ORDER BY c.relname"
+    )).all()
+    db.commit()
+    return [(name, comment) for name, comment in rows if PARTITION_NAME.match(name)]
+
+
+def _payments_in_flight(db: Session, name: str) -> int:
+    return db.execute(text(
+        f"SELECT count(*) FROM {name} o JOIN payments p ON p.order_id = o.id "
+        "WHERE p.status IN ('pending', 'processing')"
+    )).scalar()
+
+
+def abandon_unsettled_orders(db: Session, name: str) -> int:
+    """Mark the orders of a partition that were never paid as abandoned.
+
+    The status counters move with them. Returns the number of orders marked.
+    """
+    # Imported here: models imports this module for the partition DDL
+    from . import crud  # pylint: disable=import-outside-toplevel
+
+    amounts = db.execute(text(
+        f"UPDATE {name} SET status = '{ABANDONED_STATUS}' WHERE status = '{UNSETTLED_STATUS}' RETURNING amount"
+    )).scalars().all()
+    if amounts:
+        revenue = sum(amount or 0.0 for amount in amounts)
+        crud._update_order_aggregates(db, [  # pylint: disable=protected-access
+            ("status", UNSETTLED_STATUS, -len(amounts), -revenue),
+            ("status", ABANDONED_STATUS, len(amounts), revenue),
+        ])
+    return len(amounts)
+
+
+def export_partition(db: Session, name: str, directory: str) -> str:
+    """Write the orders of a partition to ``<directory>/<name>.jsonl.gz``."""
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{name}.jsonl.gz")
+    result = db.execute(
+        text(
+            f"SELECT o.id, o.user_id, o.product_id, o.status, o.amount, o.created_at, "
+            f"p.amount AS payment_amount, p.status AS payment_status, p.provider_reference "
+            f"FROM {name} o LEFT JOIN payments p ON p.order_id = o.id ORDER BY o.created_at"
+        ).execution_options(yield_per=1000)
+    )
+    # Written under a temporary name so a crash never leaves a partial export
+    with gzip.open(path + ".tmp", "wt", encoding="utf-8") as file:
+        for row in result.mappings():
+            file.write(json.dumps(dict(row), default=str) + "\n")
+    os.replace(path + ".tmp", path)
+    return path
+
+
+def archive_order_partitions(
+    db: Session,
+    archive_after_days: int = None,
+    export_dir: str = None,
+    tablespace: str = None,
+    drop: bool = None,
+) -> list:
+    """Archive the monthly partitions older than ``archive_after_days``.
+
+    Unset arguments come from the settings. Returns the names of the
+    partitions archived.
+    """
+    settings = get_settings()
+    if archive_after_days is None:
+        archive_after_days = settings.orders_archive_after_days
+    export_dir = export_dir or settings.orders_archive_dir
+    tablespace = tablespace or settings.orders_cold_tablespace
+    drop = settings.orders_archive_drop if drop is None else drop
+    if drop and not export_dir:
+        raise ValueError("Dropping archived partitions requires an export directory")
+
+    cutoff = (datetime.utcnow() - timedelta(days=archive_after_days)).date()
+    preparer = db.get_bind().dialect.identifier_preparer
+    archived = []
+    for name, comment in list_order_partitions(db):
+        if comment == ARCHIVED_COMMENT:
+            continue
+        year, month = PARTITION_NAME.match(name).groups()
+        if _add_months(date(int(year), int(month), 1), 1) > cutoff:
+            continue
+        if _payments_in_flight(db, name):
+            logger.info("Skipping %s: payments still in flight", name)
+            db.rollback()
+            continue
+        abandoned = abandon_unsettled_orders(db, name)
+        if abandoned:
+            logger.info("Marked %s unpaid orders of %s as %s", abandoned, name, ABANDONED_STATUS)
+        if export_dir:
+            logger.info("Exported %s to %s", name, export_partition(db, name, export_dir))
+        if drop:
+            db.execute(text(f"ALTER TABLE orders DETACH PARTITION {name}"))
+            db.execute(text(f"DROP TABLE {name}"))
+        else:
+            if tablespace:
+                db.execute(text(f"ALTER TABLE {name} SET TABLESPACE {preparer.quote(tablespace)}"))
+            db.execute(text(f"COMMENT ON TABLE {name} IS '{ARCHIVED_COMMENT}'"))
+        db.commit()
+        archived.append(name)
+        logger.info("Archived %s", name)
+    return archived
+
+
+def main() -> None:
+    """Create upcoming partitions and archive the old ones."""
+    parser = argparse.ArgumentParser(description="Maintain the partitions of the orders table.")
+    parser.add_argument("--skip-archive", action="store_true", help="only create upcoming partitions")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    db = create_session()
+    try:
+        for name in ensure_order_partitions(db):
+            logger.info("Created partition %s", name)
+        if not args.skip_archive:
+            archive_order_partitions(db)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,19 @@
 """CRUD operations for database models."""
+import random
+from datetime import datetime, timedelta
 
+from sqlalchemy import func, or_
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.orm import Session
 
 from . import models
+from .database import releases_connection
+from ..shared.settings import get_settings
+from ..shared.tracing import traced
 
 # Funcții CRUD pentru utilizatori
+@traced()
+@releases_connection
 def create_user(db: Session, username: str, password: str, role: str = "user"):
     """Creează un utilizator nou"""
     db_user = models.User(username=username, password=password, role=role)
@@ -13,19 +22,27 @@ def create_user(db: Session, username: str, password: str, role: str = "user"):
     db.refresh(db_user)
     return db_user
 
+@traced()
+@releases_connection
 def get_user(db: Session, user_id: int):
     """Obține un utilizator după ID"""
     return db.query(models.User).filter(models.User.id == user_id).first()
 
+@traced()
+@releases_connection
 def get_user_by_username(db: Session, username: str):
     """Obține un utilizator după username"""
     return db.query(models.User).filter(models.User.username == username).first()
 
 # Funcții CRUD pentru produse
+@traced()
+@releases_connection
 def get_product(db: Session, product_id: int):
     """Obține un produs după ID"""
     return db.query(models.Product).filter(models.Product.id == product_id).first()
 
+@traced()
+@releases_connection
 def get_products(db: Session, query: str = None, skip: int = 0, limit: int = 100):
     """Obține o listă de produse"""
     if query:
@@ -43,6 +60,8 @@ def get_products(db: Session, query: str = None, skip: int = 0, limit: int = 100
         for product in products
     ]
 
+@traced()
+@releases_connection
 def create_product(db: Session, product):
     """Creează un produs nou"""
     db_product = models.Product(id=product.id, title=product.title, authors=product.authors, published_date=product.published_date, description=product.description, price=product.price)
@@ -51,41 +70,323 @@ def create_product(db: Session, product):
     db.refresh(db_product)
     return db_product
 
+@traced()
+@releases_connection
+def upsert_products(db: Session, rows: list):
+    """Inserează sau actualizează un lot de produse, actualizând doar coloanele prezente"""
+    # ON CONFLICT nu poate atinge același rând de două ori, ultimul rând câștigă
+    rows = list({row["id"]: row for row in rows}.values())
+    # O instrucțiune pentru fiecare set de coloane; cele lipsă rămân neatinse
+    groups = {}
+    for row in rows:
+        groups.setdefault(tuple(sorted(row)), []).append(row)
+    for columns, group in groups.items():
+        stmt = insert(models.Product).values(group)
+        updated = {column: stmt.excluded[column] for column in columns if column != "id"}
+        stmt = stmt.on_conflict_do_update(index_elements=[models.Product.id], set_=updated)
+        db.execute(stmt)
+    db.commit()
+    return len(rows)
+
 # Funcții CRUD pentru comenzi
+@traced()
+@releases_connection
 def create_order(db: Session, user_id: int, product_id: int):
     """Creează o comandă nouă"""
-    db_order = models.Order(user_id=user_id, product_id=product_id, status="created")
+    price = db.query(models.Product.price).filter(models.Product.id == product_id).scalar() or 0.0
+    db_order = models.Order(user_id=user_id, product_id=product_id, status="created", amount=price)
     db.add(db_order)
+    _update_order_aggregates(db, [
+        ("product", product_id, 1, price),
+        ("user", user_id, 1, price),
+        ("status", "created", 1, price),
+    ])
     db.commit()
     db.refresh(db_order)
     return db_order
 
+@traced()
+@releases_connection
 def get_order(db: Session, order_id: int):
     """Obține o comandă după ID"""
-    return db.query(models.Order).filter(models.Order.id == order_id).first()
+    return _find_order(db, order_id)
+
+def _recent_orders(query, history: bool):
+    """Limitează interogarea la partițiile recente, dacă nu se cere tot istoricul"""
+    if history:
+        return query
+    since = datetime.utcnow() - timedelta(days=get_settings().orders_hot_days)
+    return query.filter(models.Order.created_at >= since)
 
-def get_orders(db: Session):
-    """Obține toate comenzile"""
-    return db.query(models.Order).all()
+def _find_order(db: Session, order_id: int, lock: bool = False):
+    """Caută comanda întâi în partițiile recente, apoi în tot istoricul"""
+    for history in (False, True):
+        query = _recent_orders(db.query(models.Order).filter(models.Order.id == order_id), history)
+        if lock:
+            query = query.with_for_update()
+        order = query.first()
+        if order:
+            return order
+    return None
 
-def get_user_orders(db: Session, user_id: int):
-    """Obține comenzile unui utilizator"""
-    orders = db.query(models.Order).filter(models.Order.user_id == user_id).all()
+@traced()
+@releases_connection
+def get_orders(db: Session, skip: int = 0, limit: int = None, history: bool = False):
+    """Obține comenzile recente, cele mai noi primele (tot istoricul cu history=True)"""
+    query = _recent_orders(db.query(models.Order), history)
+    query = query.order_by(models.Order.created_at.desc()).offset(skip)
+    if limit is not None:
+        query = query.limit(limit)
+    return query.all()
+
+@traced()
+@releases_connection
+def get_user_orders(db: Session, user_id: int, skip: int = 0, limit: int = None, history: bool = False):
+    """Obține comenzile recente ale unui utilizator (tot istoricul cu history=True)"""
+    query = _recent_orders(db.query(models.Order).filter(models.Order.user_id == user_id), history)
+    query = query.order_by(models.Order.created_at.desc()).offset(skip)
+    if limit is not None:
+        query = query.limit(limit)
     return [
         {
             "id": order.id,
+            "user_id": order.user_id,
             "product_id": order.product_id,
-            "status": order.status
+            "status": order.status,
+            "created_at": order.created_at
         }
-        for order in orders
+        for order in query.all()
     ]
 
+@traced()
+@releases_connection
 def set_order_status(db: Session, order_id: int, status: str):
     """Setează statutul unei comenzi"""
-    order = db.query(models.Order).filter(models.Order.id == order_id).first()
+    order = _move_order_status(db, order_id, status)
     if not order:
         return None
-    order.status = status
     db.commit()
     db.refresh(order)
-    return order.status
\ No newline at end of file
+    return order.status
+
+def _move_order_status(db: Session, order_id: int, status: str):
+    """Schimbă statutul și agregatele unei comenzi fără commit"""
+    # Blocăm rândul ca actualizările concurente să nu scadă de două ori același statut
+    order = _find_order(db, order_id, lock=True)
+    if not order:
+        return None
+    if order.status != status:
+        amount = order.amount or 0.0
+        _update_order_aggregates(db, [
+            ("status", order.status, -1, -amount),
+            ("status", status, 1, amount),
+        ])
+    order.status = status
+    return order
+
+# Agregate pentru comenzi
+def _update_order_aggregates(db: Session, changes: list):
+    """Adaugă diferențele (dimensiune, cheie, comenzi, valoare) în aceeași tranzacție"""
+    # Un slot aleator per tranzacție: comenzile concurente nu așteaptă toate după
+    # același rând (de ex. statutul "created"). Rândurile sunt blocate mereu în
+    # aceeași ordine, ca tranzacțiile să nu se blocheze reciproc.
+    slot = random.randrange(get_settings().order_aggregate_slots)
+    for dimension, key, count, revenue in sorted(changes, key=lambda change: (change[0], str(change[1]))):
+        stmt = insert(models.OrderAggregate).values(
+            dimension=dimension, key=str(key), slot=slot, order_count=count, revenue=revenue
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[
+                models.OrderAggregate.dimension, models.OrderAggregate.key, models.OrderAggregate.slot
+            ],
+            set_={
+                "order_count": models.OrderAggregate.order_count + stmt.excluded.order_count,
+                "revenue": models.OrderAggregate.revenue + stmt.excluded.revenue,
+            }
+        )
+        db.execute(stmt)
+
+@traced()
+@releases_connection
+def get_order_aggregates(db: Session, dimension: str, limit: int = None, order_by: str = "revenue"):
+    """Obține agregatele unei dimensiuni (suma sloturilor), descrescător după valoare sau număr de comenzi"""
+    orders = func.sum(models.OrderAggregate.order_count)
+    revenue = func.sum(models.OrderAggregate.revenue)
+    query = (
+        db.query(models.OrderAggregate.key, orders, revenue)
+        .filter(models.OrderAggregate.dimension == dimension)
+        .group_by(models.OrderAggregate.key)
+        .order_by((orders if order_by == "orders" else revenue).desc())
+    )
+    if limit is not None:
+        query = query.limit(limit)
+    return [
+        {
+            "key": key,
+            "orders": order_count,
+            "revenue": order_revenue
+        }
+        for key, order_count, order_revenue in query.all()
+    ]
+
+@traced()
+@releases_connection
+def rebuild_order_aggregates(db: Session):
+    """Recalculează toate agregatele din tabela de comenzi"""
+    amount = func.coalesce(models.Order.amount, 0.0)
+    db.query(models.OrderAggregate).delete()
+    for dimension, column in (
+        ("product", models.Order.product_id),
+        ("user", models.Order.user_id),
+        ("status", models.Order.status),
+    ):
+        rows = (
+            db.query(column, func.count(models.Order.id), func.sum(amount))
+            .group_by(column)
+            .all()
+        )
+        db.add_all(
+            models.OrderAggregate(
+                dimension=dimension, key=str(key), slot=0, order_count=count, revenue=revenue or 0.0
+            )
+            for key, count, revenue in rows
+        )
+    db.commit()
+
+# Funcții CRUD pentru plăți
+@traced()
+@releases_connection
+def create_payment(db: Session, order_id: int, amount: float):
+    """Creează o plată în așteptare pentru o comandă"""
+    db_payment = models.Payment(order_id=order_id, amount=amount, status="pending")
+    db.add(db_payment)
+    db.commit()
+    db.refresh(db_payment)
+    return db_payment
+
+@traced()
+@releases_connection
+def get_payment(db: Session, payment_id: int):
+    """Obține o plată după ID"""
+    return db.query(models.Payment).filter(models.Payment.id == payment_id).first()
+
+@traced()
+@releases_connection
+def get_payment_by_order(db: Session, order_id: int):
+    """Obține plata unei comenzi"""
+    return db.query(models.Payment).filter(models.Payment.order_id == order_id).first()
+
+@traced()
+@releases_connection
+def get_payment_by_reference(db: Session, provider_reference: str):
+    """Obține o plată după referința furnizorului"""
+    return db.query(models.Payment).filter(models.Payment.provider_reference == provider_reference).first()
+
+@traced()
+@releases_connection
+def claim_payment(db: Session, payment_id: int):
+    """Trece o plată din pending în processing; întoarce False dacă a preluat-o altcineva"""
+    claimed = (
+        db.query(models.Payment)
+        .filter(models.Payment.id == payment_id, models.Payment.status == "pending")
+        .update({"status": "processing", "updated_at": datetime.utcnow()}, synchronize_session=False)
+    )
+    db.commit()
+    return claimed == 1
+
+@traced()
+@releases_connection
+def set_payment_status(db: Session, payment_id: int, status: str, provider_reference: str = None, error: str = None):
+    """Setează statutul unei plăți; o plată reușită marchează comanda ca plătită, în aceeași tranzacție"""
+    payment = db.query(models.Payment).filter(models.Payment.id == payment_id).first()
+    if not payment:
+        return None
+    payment.status = status
+    payment.error = error
+    if provider_reference is not None:
+        payment.provider_reference = provider_reference
+    if status == "succeeded":
+        _move_order_status(db, payment.order_id, "paid")
+    db.commit()
+    db.refresh(payment)
+    return payment
+
+@traced()
+@releases_connection
+def retry_payment(db: Session, payment_id: int):
+    """Repune în pending o plată eșuată, ca o nouă încercare; întoarce None dacă nu mai e eșuată"""
+    retried = (
+        db.query(models.Payment)
+        .filter(models.Payment.id == payment_id, models.Payment.status == "failed")
+        .update({
+            "status": "pending",
+            "attempt": models.Payment.attempt + 1,
+            "provider_reference": None,
+            "error": None,
+            "updated_at": datetime.utcnow(),
+        }, synchronize_session=False)
+    )
+    db.commit()
+    if retried != 1:
+        return None
+    # populate_existing: plata poate fi deja încărcată în sesiune cu valorile vechi
+    return db.query(models.Payment).filter(models.Payment.id == payment_id).populate_existing().first()
+
+@traced()
+@releases_connection
+def requeue_stale_payments(db: Session, stale_before, limit: int = 100):
+    """Repune în pending plățile rămase în processing fără referință și întoarce ID-urile în așteptare"""
+    db.query(models.Payment).filter(
+        models.Payment.status == "processing",
+        models.Payment.provider_reference.is_(None),
+        models.Payment.updated_at < stale_before,
+    ).update({"status": "pending", "updated_at": datetime.utcnow()}, synchronize_session=False)
+    db.commit()
+    rows = (
+        db.query(models.Payment.id)
+        .filter(models.Payment.status == "pending", models.Payment.updated_at < stale_before)
+        .order_by(models.Payment.updated_at)
+        .limit(limit)
+        .all()
+    )
+    return [row.id for row in rows]
+
+# Funcții CRUD pentru revocarea token-urilor
+@traced()
+@releases_connection
+def revoke_token(db: Session, jti: str, expires_at=None):
+    """Revocă un singur token după jti"""
+    db_revocation = models.TokenRevocation(jti=jti, expires_at=expires_at)
+    db.add(db_revocation)
+    db.commit()
+    db.refresh(db_revocation)
+    return db_revocation
+
+@traced()
+@releases_connection
+def revoke_user_tokens(db: Session, username: str, issued_before):
+    """Revocă toate token-urile unui utilizator emise înainte de un moment"""
+    db_revocation = models.TokenRevocation(username=username, issued_before=issued_before)
+    db.add(db_revocation)
+    db.commit()
+    db.refresh(db_revocation)
+    return db_revocation
+
+@traced()
+@releases_connection
+def get_token_revocations(db: Session, after_id: int = 0, since=None, recent_since=None):
+    """Obține revocările adăugate după un ID (plus cele create după recent_since), în ordine"""
+    newer = models.TokenRevocation.id > after_id
+    if recent_since is not None:
+        newer = or_(newer, models.TokenRevocation.created_at >= recent_since)
+    query = db.query(models.TokenRevocation).filter(newer)
+    if since is not None:
+        query = query.filter(models.TokenRevocation.created_at >= since)
+    return query.order_by(models.TokenRevocation.id).all()
+
+
+@traced()
+@releases_connection
+def get_last_token_revocation_id(db: Session) -> int:
+    """Obține cel mai mare ID din tabelul de revocări (0 dacă e gol)"""
+    return db.query(func.max(models.TokenRevocation.id)).scalar() or 0
@@ -1,38 +1,186 @@
-"""Database connection and session management module."""
+"""Database connection and session management module.
 
-from sqlalchemy import create_engine
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
-from dotenv import load_dotenv
-import os
+The engine is created on first use (normally in the application's lifespan
+hook, see ``shared.lifecycle``) rather than at import, so that importing a
+service stays cheap and does not need the database driver or the network.
 
-# Încărcăm variabilele de mediu
-load_dotenv()
+Sessions are lazy: a connection is only checked out by the first query, and
+every ``crud`` function ends its transaction before returning (see
+``releases_connection``), so a request holds a connection only while it is
+actually talking to the database.
+"""
+import contextvars
+import threading
+import time
+from functools import wraps
 
-# Get database configuration from environment variables
-DB_USER = os.getenv("POSTGRES_USER", "admin")
-DB_PASSWORD = os.getenv("POSTGRES_PASSWORD", "admin")
-DB_HOST = os.getenv("POSTGRES_HOST", "postgres")
-DB_NAME = os.getenv("POSTGRES_DB", "app")
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.orm import declarative_base, sessionmaker
+from sqlalchemy.pool import Pool, QueuePool
 
-# Construct the database URL without any protocol prefixes in the host
-DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:5432/{DB_NAME}"
+from ..shared.profiling import profile_stage
+from ..shared.settings import get_settings
 
-print(DATABASE_URL)
+_engine = None
+_engine_lock = threading.Lock()
 
-# Creare engine SQLAlchemy
-engine = create_engine(DATABASE_URL)
-
-# Creare sesiune
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Creare sesiune, legată de engine la prima utilizare. Obiectele rămân
+# încărcate după commit, ca să poată fi serializate fără o nouă conexiune.
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False)
 
 # Baza pentru modelele declarative
 Base = declarative_base()
 
+
+def get_engine():
+    """Return the SQLAlchemy engine, creating it on first use."""
+    global _engine  # pylint: disable=global-statement
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                settings = get_settings()
+                engine = create_engine(
+                    settings.database_url,
+                    pool_pre_ping=True,
+                    pool_size=settings.db_pool_size,
+                    max_overflow=settings.db_max_overflow,
+                    pool_timeout=settings.db_pool_timeout,
+                )
+                SessionLocal.configure(bind=engine)
+                _engine = engine
+    return _engine
+
+
+def create_session():
+    """Open a new session, creating the engine if needed."""
+    get_engine()
+    return SessionLocal()
+
+
+def warm_up(connections: int = None) -> None:
+    """Create the engine and open pool connections ahead of the first request."""
+    engine = get_engine()
+    if connections is None:
+        connections = get_settings().db_warm_connections
+    opened = [engine.connect() for _ in range(max(1, connections))]
+    try:
+        for connection in opened:
+            connection.execute(text("SELECT 1"))
+    finally:
+        for connection in opened:
+            connection.close()
+
+
+def check_connection() -> None:
+    """Run a trivial query, raising if the database cannot be reached."""
+    with get_engine().connect() as connection:
+        connection.execute(text("SELECT 1"))
+
+
+def pool_status() -> dict:
+    """Describe the connection pool of the engine, if it exists."""
+    if _engine is None:
+        return {}
+    pool = _engine.pool
+    if not isinstance(pool, QueuePool):
+        return {"status": pool.status()}
+    return {
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "overflow": pool.overflow(),
+    }
+
+
+def dispose_engine() -> None:
+    """Close all pooled connections."""
+    if _engine is not None:
+        _engine.dispose()
+
+
+def releases_connection(func):
+    """Return the session's connection to the pool when ``func`` returns.
+
+    ``func`` takes the session as its first argument. Only the outermost
+    decorated call ends the transaction: it is committed on success (the
+    ``crud`` functions have already committed their writes, so this only
+    closes read transactions) and rolled back on error. Loaded objects stay
+    usable because sessions do not expire them on commit.
+
+    In profiled requests the outermost call is recorded as the ``orm`` stage:
+    its SQL is recorded separately, which leaves building the queries and
+    hydrating the results into objects.
+    """
+    @wraps(func)
+    def wrapper(db, *args, **kwargs):
+        depth = db.info.get("call_depth", 0)
+        db.info["call_depth"] = depth + 1
+        try:
+            if depth == 0:
+                with profile_stage("orm"):
+                    result = func(db, *args, **kwargs)
+            else:
+                result = func(db, *args, **kwargs)
+        except Exception:
+            db.info["call_depth"] = depth
+            if depth == 0:
+                db.rollback()
+            raise
+        db.info["call_depth"] = depth
+        if depth == 0 and db.in_transaction():
+            db.commit()
+        return result
+    return wrapper
+
+
+class ConnectionUsage:
+    """Connections checked out while handling one request."""
+
+    def __init__(self):
+        self.checkouts = 0
+        self.held = 0.0
+        self.open = {}
+
+    def hold_seconds(self) -> float:
+        """Total time connections were held, counting those still checked out."""
+        now = time.perf_counter()
+        return self.held + sum(now - started for started in self.open.values())
+
+
+_connection_usage = contextvars.ContextVar("connection_usage", default=None)
+
+
+def track_connection_usage() -> ConnectionUsage:
+    """Record the connections checked out from now on in the current context."""
+    usage = ConnectionUsage()
+    _connection_usage.set(usage)
+    return usage
+
+
+@event.listens_for(Pool, "checkout")
+def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+    usage = _connection_usage.get()
+    if usage is None:
+        return
+    usage.checkouts += 1
+    usage.open[id(connection_record)] = time.perf_counter()
+    # The checkin can run in another context (e.g. when the session is closed)
+    connection_record.info["usage"] = usage
+
+
+@event.listens_for(Pool, "checkin")
+def _on_checkin(dbapi_connection, connection_record):
+    usage = connection_record.info.pop("usage", None)
+    if usage is None:
+        return
+    started = usage.open.pop(id(connection_record), None)
+    if started is not None:
+        usage.held += time.perf_counter() - started
+
+
 # Funcție de utilitate pentru a obține o sesiune DB
 def get_db():
     """Return a database session that will be automatically closed when finished."""
-    db = SessionLocal()
+    db = create_session()
     try:
         yield db
     finally:
@@ -0,0 +1,138 @@
+"""Streaming parsers used by the bulk product import.
+
+The upload body is consumed chunk by chunk, so the whole catalog is never
+held in memory; rows are validated one at a time and grouped into batches
+that are written with a single statement each.
+"""
+import codecs
+import csv
+import json
+from datetime import date
+from typing import AsyncIterator, List, Optional, Tuple
+
+from pydantic import BaseModel, ValidationError
+
+PRODUCT_FIELDS = ("id", "title", "authors", "published_date", "description", "price")
+
+
+class ProductImportRow(BaseModel):
+    """A single validated row of a product import."""
+    id: int
+    title: str
+    authors: Optional[str] = None
+    published_date: Optional[date] = None
+    description: Optional[str] = None
+    price: float
+
+
+class RowError(Exception):
+    """Raised for a row that cannot be parsed or validated."""
+
+    def __init__(self, line: int, message: str):
+        super().__init__(message)
+        self.line = line
+        self.message = message
+
+
+def validate_row(line: int, raw: dict) -> dict:
+    """Validate a raw row and return the values to be written.
+
+    Only the fields present in the row are returned, so importing a partial
+    row never overwrites the other columns of an existing product.
+    """
+    try:
+        row = ProductImportRow(**{key: value for key, value in raw.items() if value not in ("", None)})
+    except ValidationError as e:
+        errors = "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors())
+        raise RowError(line, errors) from e
+    return row.model_dump(include=set(PRODUCT_FIELDS), exclude_unset=True)
+
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """Split a stream of byte chunks into decoded text lines."""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    pending = ""
+    async for chunk in chunks:
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            yield line.rstrip("\r")
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending.rstrip("\r")
+
+
+async def iter_ndjson(chunks: AsyncIterator[bytes]) -> AsyncIterator[Tuple[int, object]]:
+    """Yield ``(line, row)`` pairs from an NDJSON stream.
+
+    ``row`` is either a validated dict or a :class:`RowError`.
+    """
+    line_no = 0
+    async for line in iter_lines(chunks):
+        line_no += 1
+        if not line.strip():
+            continue
+        try:
+            raw = json.loads(line)
+            if not isinstance(raw, dict):
+                raise RowError(line_no, "expected a JSON object")
+            yield line_no, validate_row(line_no, raw)
+        except json.JSONDecodeError as e:
+            yield line_no, RowError(line_no, f"invalid JSON: {e.msg}")
+        except RowError as e:
+            yield line_no, e
+
+
+async def iter_csv(chunks: AsyncIterator[bytes]) -> AsyncIterator[Tuple[int, object]]:
+    """Yield ``(line, row)`` pairs from a CSV stream with a header row.
+
+    Quoted fields may span several lines; a record is only parsed once its
+    quotes are balanced.
+    """
+    header = None
+    record = ""
+    line_no = 0
+    start = 0
+    async for line in iter_lines(chunks):
+        line_no += 1
+        if not record:
+            start = line_no
+            record = line
+        else:
+            record += "\n" + line
+        if record.count('"') % 2:
+            continue
+        text, record = record, ""
+        if not text.strip():
+            continue
+        fields = next(csv.reader([text]))
+        if header is None:
+            header = [name.strip() for name in fields]
+            continue
+        if len(fields) != len(header):
+            yield start, RowError(start, f"expected {len(header)} columns, got {len(fields)}")
+            continue
+        try:
+            yield start, validate_row(start, dict(zip(header, fields)))
+        except RowError as e:
+            yield start, e
+    if record:
+        yield start, RowError(start, "unterminated quoted field")
+
+
+async def iter_batches(
+    rows: AsyncIterator[Tuple[int, object]], size: int
+) -> AsyncIterator[Tuple[List[dict], List[RowError]]]:
+    """Group parsed rows into batches of at most ``size`` valid rows."""
+    batch: List[dict] = []
+    errors: List[RowError] = []
+    async for _, row in rows:
+        if isinstance(row, RowError):
+            errors.append(row)
+            continue
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch, errors
+            batch, errors = [], []
+    if batch or errors:
+        yield batch, errors
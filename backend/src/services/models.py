@@ -1,9 +1,10 @@
 """Database models for the services module."""
 import datetime
 
-from sqlalchemy import Column, Integer, String, Float, Text, Date, ForeignKey
+from sqlalchemy import Column, Integer, String, Float, Text, Date, DateTime, ForeignKey, Index, event
 from sqlalchemy.orm import relationship
 
+from .archival import create_initial_partitions
 from .database import Base
 
 
@@ -35,26 +36,99 @@ class Product(Base): # pylint: disable=R0903
 
 
 class Order(Base): # pylint: disable=R0903
-    """Order model tracking purchases made by users."""
+    """Order model tracking purchases made by users.
+
+    On PostgreSQL the table is range-partitioned by ``created_at``, one
+    partition per month (see ``services.archival``), so ``created_at`` is part
+    of the primary key and other tables cannot declare a foreign key to it.
+    """
     __tablename__ = "orders"
 
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True, autoincrement=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
     product_id = Column(Integer, ForeignKey("products.id"))
     status = Column(String, default="created")
+    # Price of the product when the order was placed
+    amount = Column(Float, default=0.0)
+    created_at = Column(DateTime, primary_key=True, default=datetime.datetime.utcnow)
 
     user = relationship("User", back_populates="orders")
     product = relationship("Product", back_populates="orders")
-    payment = relationship("Payment", back_populates="order", uselist=False)
+    payment = relationship(
+        "Payment", back_populates="order", uselist=False,
+        primaryjoin="Order.id == foreign(Payment.order_id)"
+    )
+
+    __table_args__ = (
+        Index("ix_orders_user_id_created_at", "user_id", "created_at"),
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
+
+
+# Creates orders_default and the partitions of the upcoming months
+event.listen(Order.__table__, "after_create", create_initial_partitions)
 
 
 class Payment(Base): # pylint: disable=R0903
-    """Payment model tracking financial transactions for orders."""
+    """Payment model tracking financial transactions for orders.
+
+    ``status`` moves from ``pending`` to ``processing`` while the provider is
+    called, then to ``succeeded`` or ``failed``. A payment that stays
+    ``processing`` with a ``provider_reference`` waits for the provider's
+    confirmation webhook. Paying a ``failed`` payment again starts a new
+    ``attempt``, which is part of the provider's idempotency key.
+    """
     __tablename__ = "payments"
 
     id = Column(Integer, primary_key=True, index=True)
-    order_id = Column(Integer, ForeignKey("orders.id"), unique=True)
+    order_id = Column(Integer, unique=True)
     amount = Column(Float)
     status = Column(String, default="pending")
+    attempt = Column(Integer, default=1)
+    provider_reference = Column(String, unique=True, nullable=True)
+    error = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+
+    order = relationship("Order", back_populates="payment", primaryjoin="foreign(Payment.order_id) == Order.id")
+
+    __table_args__ = (
+        Index("ix_payments_status_updated_at", "status", "updated_at"),
+    )
+
 
-    order = relationship("Order", back_populates="payment")
+class OrderAggregate(Base): # pylint: disable=R0903
+    """Order counters and order value maintained incrementally by ``crud``.
+
+    ``dimension`` is one of ``product``, ``user`` or ``status`` and ``key`` is
+    the product id, user id or status name. Each counter is spread over up to
+    ``ORDER_AGGREGATE_SLOTS`` rows (``slot``) and read as their sum, so that
+    concurrent orders rarely wait on the same row lock.
+    """
+    __tablename__ = "order_aggregates"
+
+    dimension = Column(String, primary_key=True)
+    key = Column(String, primary_key=True)
+    slot = Column(Integer, primary_key=True, default=0)
+    order_count = Column(Integer, default=0, nullable=False)
+    revenue = Column(Float, default=0.0, nullable=False)
+
+    __table_args__ = (
+        Index("ix_order_aggregates_dimension_key", "dimension", "key"),
+    )
+
+
+class TokenRevocation(Base): # pylint: disable=R0903
+    """Revocation log read incrementally by every service.
+
+    A row either revokes a single token (``jti``) or every token of
+    ``username`` issued before ``issued_before``.
+    """
+    __tablename__ = "token_revocations"
+
+    id = Column(Integer, primary_key=True, index=True)
+    jti = Column(String, index=True, nullable=True)
+    username = Column(String, index=True, nullable=True)
+    issued_before = Column(DateTime, nullable=True)
+    expires_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow, index=True)
@@ -0,0 +1,404 @@
+"""Payment processing for the payment service.
+
+``POST /payment`` only writes a pending ``Payment`` row and queues its id. A
+pool of worker tasks then charges the payment through the configured
+provider, so the request returns immediately and the number of in-flight
+provider calls is bounded by the number of workers, not by request threads.
+
+Providers are pluggable: ``HttpPaymentProvider`` talks to a remote provider
+through one pooled ``httpx.AsyncClient`` and ``StubPaymentProvider`` answers
+locally for development and tests. Both share the retry loop and the circuit
+breaker of ``PaymentProvider``. The payment id is sent as idempotency key, so
+retrying a charge (or charging a payment again after a crash) is safe.
+
+Payments left ``pending`` (queue full, provider unavailable, crash) are
+picked up again by a periodic sweep; a provider answering ``pending``
+confirms the payment later through the webhook.
+"""
+import asyncio
+import hashlib
+import hmac
+import logging
+import random
+import time
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Optional
+
+import httpx
+from fastapi.concurrency import run_in_threadpool
+from prometheus_client import Counter, Gauge, Histogram
+
+from . import crud
+from .database import create_session
+from ..shared.settings import get_settings
+from ..shared.tracing import start_span
+
+logger = logging.getLogger(__name__)
+
+# Metrics
+PROVIDER_CALLS = Counter(
+    "payment_provider_calls_total",
+    "Payment provider calls by outcome",
+    ["provider", "outcome"]
+)
+PROVIDER_LATENCY = Histogram(
+    "payment_provider_call_duration_seconds",
+    "Latency of a single payment provider call",
+    ["provider"]
+)
+CIRCUIT_OPEN = Gauge(
+    "payment_provider_circuit_open",
+    "Whether the circuit breaker of the payment provider is open",
+    ["provider"]
+)
+QUEUED_PAYMENTS = Gauge(
+    "payment_queue_depth",
+    "Payments waiting for a worker"
+)
+PAYMENTS = Counter(
+    "payments_total",
+    "Payments finished by the workers, by status",
+    ["status"]
+)
+
+
+class ProviderUnavailable(Exception):
+    """The provider could not be reached; the payment should be retried later."""
+
+
+class TransientProviderError(ProviderUnavailable):
+    """A single provider call failed in a way worth retrying immediately."""
+
+
+@dataclass
+class ChargeResult:
+    """Outcome of a charge: ``succeeded``, ``failed`` or ``pending`` (webhook)."""
+    status: str
+    reference: Optional[str] = None
+    error: Optional[str] = None
+
+
+class CircuitBreaker:
+    """Stop calling a failing provider for a while.
+
+    After ``failure_threshold`` consecutive failures the circuit opens and
+    calls fail fast. Once ``reset_timeout`` has passed a single trial call is
+    let through: success closes the circuit, failure opens it again.
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        """``closed``, ``open`` or ``half_open``."""
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.reset_timeout:
+            return "open"
+        return "half_open"
+
+    def allow(self) -> bool:
+        """Whether a call may be made now."""
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self.trial_in_flight:
+            self.trial_in_flight = True
+            return True
+        return False
+
+    def record_success(self) -> None:
+        """Close the circuit."""
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    def record_failure(self) -> None:
+        """Count a failure, opening the circuit past the threshold."""
+        self.failures += 1
+        if self.trial_in_flight or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+        self.trial_in_flight = False
+
+
+class PaymentProvider:
+    """Base class for payment providers.
+
+    Subclasses implement ``_charge_once`` and raise ``TransientProviderError``
+    for failures worth retrying; ``charge`` adds retries with exponential
+    backoff and the circuit breaker.
+    """
+
+    name = "provider"
+
+    def __init__(self, retries: int, backoff: float, breaker: CircuitBreaker):
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker = breaker
+
+    async def charge(self, payment_id: int, amount: float, attempt: int = 1) -> ChargeResult:
+        """Charge ``amount`` for an attempt of a payment, retrying transient failures.
+
+        Retries reuse the attempt's idempotency key, so the provider charges
+        at most once per attempt.
+        """
+        for retry in range(self.retries + 1):
+            if not self.breaker.allow():
+                CIRCUIT_OPEN.labels(provider=self.name).set(1)
+                PROVIDER_CALLS.labels(provider=self.name, outcome="circuit_open").inc()
+                raise ProviderUnavailable("Circuit breaker open")
+            start_time = time.perf_counter()
+            try:
+                with start_span("payment.provider", provider=self.name, attempt=attempt, retry=retry):
+                    result = await self._charge_once(payment_id, amount, attempt)
+            except TransientProviderError as e:
+                self.breaker.record_failure()
+                PROVIDER_CALLS.labels(provider=self.name, outcome="error").inc()
+                error = e
+            except Exception:
+                # Not retried, but still counted: a failed half-open trial must reopen the circuit
+                self.breaker.record_failure()
+                PROVIDER_CALLS.labels(provider=self.name, outcome="error").inc()
+                raise
+            else:
+                self.breaker.record_success()
+                CIRCUIT_OPEN.labels(provider=self.name).set(0)
+                PROVIDER_CALLS.labels(provider=self.name, outcome=result.status).inc()
+                return result
+            finally:
+                PROVIDER_LATENCY.labels(provider=self.name).observe(time.perf_counter() - start_time)
+            if retry < self.retries:
+                # Full jitter keeps the retries of concurrent payments apart
+                await asyncio.sleep(random.uniform(0, self.backoff * 2 ** retry))
+        raise ProviderUnavailable(str(error))
+
+    async def _charge_once(self, payment_id: int, amount: float, attempt: int) -> ChargeResult:
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        """Release the resources held by the provider."""
+
+
+class HttpPaymentProvider(PaymentProvider):
+    """Provider reached over HTTP through a pooled async client.
+
+    ``POST {url}/charges`` receives ``{"amount", "reference"}`` and answers
+    ``{"id", "status"}``, ``status`` being ``succeeded``, ``failed`` or
+    ``pending``. Timeouts, connection errors, 429 and 5xx responses are
+    retried; other 4xx responses decline the payment.
+    """
+
+    name = "http"
+
+    def __init__(self, url: str, api_key: Optional[str], timeout: float, max_connections: int, **kwargs):
+        super().__init__(**kwargs)
+        headers = {"Authorization": f"Bearer {api_key}"} if api_key else {}
+        self.client = httpx.AsyncClient(
+            base_url=url,
+            headers=headers,
+            timeout=httpx.Timeout(timeout),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        )
+
+    async def _charge_once(self, payment_id: int, amount: float, attempt: int) -> ChargeResult:
+        try:
+            response = await self.client.post(
+                "/charges",
+                json={"amount": amount, "reference": str(payment_id)},
+                headers={"Idempotency-Key": f"payment-{payment_id}-{attempt}"},
+            )
+        except httpx.HTTPError as e:
+            raise TransientProviderError(f"{type(e).__name__}: {e}") from e
+        if response.status_code == 429 or response.status_code >= 500:
+            raise TransientProviderError(f"Provider returned {response.status_code}")
+        if response.status_code >= 400:
+            return ChargeResult("failed", error=f"Provider returned {response.status_code}: {response.text[:200]}")
+        try:
+            body = response.json()
+        except ValueError as e:
+            raise TransientProviderError(f"Invalid provider response: {e}") from e
+        if not isinstance(body, dict):
+            raise TransientProviderError(f"Unexpected provider response {type(body).__name__}")
+        status = body.get("status")
+        if status not in ("succeeded", "failed", "pending"):
+            raise TransientProviderError(f"Unexpected provider status {status!r}")
+        return ChargeResult(status, reference=body.get("id"), error=body.get("error"))
+
+    async def close(self) -> None:
+        await self.client.aclose()
+
+
+class StubPaymentProvider(PaymentProvider):
+    """Local provider for development and tests.
+
+    Waits ``latency`` seconds, fails transiently with probability
+    ``failure_rate`` and declines non-positive amounts.
+    """
+
+    name = "stub"
+
+    def __init__(self, latency: float, failure_rate: float, **kwargs):
+        super().__init__(**kwargs)
+        self.latency = latency
+        self.failure_rate = failure_rate
+
+    async def _charge_once(self, payment_id: int, amount: float, attempt: int) -> ChargeResult:
+        await asyncio.sleep(self.latency)
+        if random.random() < self.failure_rate:
+            raise TransientProviderError("Simulated provider failure")
+        if amount is None or amount <= 0:
+            return ChargeResult("failed", error="Invalid amount")
+        return ChargeResult("succeeded", reference=f"stub_{uuid.uuid4().hex}")
+
+
+def create_provider() -> PaymentProvider:
+    """Build the provider selected by ``PAYMENT_PROVIDER`` (``stub`` or ``http``)."""
+    settings = get_settings()
+    common = {
+        "retries": settings.payment_provider_retries,
+        "backoff": settings.payment_provider_backoff_seconds,
+        "breaker": CircuitBreaker(
+            settings.payment_circuit_failure_threshold, settings.payment_circuit_reset_seconds
+        ),
+    }
+    if settings.payment_provider == "http":
+        return HttpPaymentProvider(
+            url=settings.payment_provider_url,
+            api_key=settings.payment_provider_api_key,
+            timeout=settings.payment_provider_timeout_seconds,
+            max_connections=settings.payment_provider_max_connections,
+            **common,
+        )
+    if settings.payment_provider == "stub":
+        return StubPaymentProvider(
+            latency=settings.payment_stub_latency_seconds,
+            failure_rate=settings.payment_stub_failure_rate,
+            **common,
+        )
+    raise ValueError(f"Unknown payment provider {settings.payment_provider!r}")
+
+
+def sign_webhook(secret: str, body: bytes) -> str:
+    """HMAC-SHA256 signature of a webhook body, as sent in ``X-Signature``."""
+    return hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+
+def verify_webhook(secret: Optional[str], body: bytes, signature: Optional[str]) -> bool:
+    """Check the signature of a confirmation webhook."""
+    if not secret or not signature:
+        return False
+    return hmac.compare_digest(sign_webhook(secret, body), signature)
+
+
+def _call(func, *args, **kwargs):
+    """Run a ``crud`` function in a session of its own."""
+    db = create_session()
+    try:
+        return func(db, *args, **kwargs)
+    finally:
+        db.close()
+
+
+class PaymentProcessor:
+    """Queue of payments charged by a fixed pool of worker tasks."""
+
+    def __init__(self, workers: int, queue_size: int, sweep_interval: float):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.sweep_interval = sweep_interval
+        self.provider = None
+        self.queue = None
+        self.queued = set()
+        self.tasks = []
+
+    async def start(self, provider: Optional[PaymentProvider] = None) -> None:
+        """Create the provider and start the workers and the sweep."""
+        self.provider = provider or create_provider()
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        loop = asyncio.get_running_loop()
+        self.tasks = [loop.create_task(self._worker()) for _ in range(self.workers)]
+        self.tasks.append(loop.create_task(self._sweep()))
+
+    async def stop(self) -> None:
+        """Stop the workers; unfinished payments are resumed by the next sweep."""
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        if self.provider is not None:
+            await self.provider.close()
+
+    def full(self) -> bool:
+        """Whether new payments would be rejected."""
+        return self.queue is None or self.queue.full()
+
+    def submit(self, payment_id: int) -> bool:
+        """Queue a payment; return False if it cannot be queued now."""
+        if payment_id in self.queued:
+            return True
+        if self.full():
+            return False
+        self.queued.add(payment_id)
+        self.queue.put_nowait(payment_id)
+        QUEUED_PAYMENTS.set(self.queue.qsize())
+        return True
+
+    async def _worker(self) -> None:
+        while True:
+            payment_id = await self.queue.get()
+            QUEUED_PAYMENTS.set(self.queue.qsize())
+            try:
+                await self.process(payment_id)
+            except Exception as e:  # pylint: disable=broad-except
+                logger.error("Error processing payment %s: %s", payment_id, str(e))
+            finally:
+                self.queued.discard(payment_id)
+                self.queue.task_done()
+
+    async def process(self, payment_id: int) -> None:
+        """Charge one pending payment and record the outcome."""
+        if not await run_in_threadpool(_call, crud.claim_payment, payment_id):
+            return
+        payment = await run_in_threadpool(_call, crud.get_payment, payment_id)
+        try:
+            result = await self.provider.charge(payment.id, payment.amount, payment.attempt or 1)
+        except ProviderUnavailable as e:
+            # Back to pending, the sweep retries it once the provider recovers
+            logger.warning("Payment %s postponed: %s", payment_id, str(e))
+            await run_in_threadpool(_call, crud.set_payment_status, payment_id, "pending", error=str(e))
+            return
+        status = "processing" if result.status == "pending" else result.status
+        await run_in_threadpool(
+            _call, crud.set_payment_status, payment_id, status,
+            provider_reference=result.reference, error=result.error,
+        )
+        if status != "processing":
+            PAYMENTS.labels(status=status).inc()
+        logger.info("Payment %s: %s", payment_id, result.status)
+
+    async def _sweep(self) -> None:
+        """Queue payments that were left pending or stuck mid-charge."""
+        while True:
+            try:
+                stale_before = datetime.utcnow() - timedelta(seconds=self.sweep_interval)
+                for payment_id in await run_in_threadpool(_call, crud.requeue_stale_payments, stale_before):
+                    if not self.submit(payment_id):
+                        break
+            except Exception as e:  # pylint: disable=broad-except
+                logger.error("Error sweeping payments: %s", str(e))
+            await asyncio.sleep(self.sweep_interval)
+
+
+_settings = get_settings()
+processor = PaymentProcessor(
+    workers=_settings.payment_workers,
+    queue_size=_settings.payment_queue_size,
+    sweep_interval=_settings.payment_sweep_seconds,
+)
@@ -0,0 +1,295 @@
+"""Admission control shared by all FastAPI services.
+
+Requests are admitted in two steps: per-user (JWT ``sub``) and per-IP token
+buckets reject abusive clients with 429, then an adaptive concurrency limit
+(AIMD on observed latency) sheds load with 503 before the event loop and the
+database pool are overwhelmed. Bucket state lives in process by default and in
+Redis when ``REDIS_URL`` is set, so it can be shared across replicas.
+"""
+import logging
+import math
+import time
+from typing import Callable, Optional
+
+import jwt
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse
+from prometheus_client import Counter, Gauge
+
+from .routing import route_path
+from .settings import get_settings
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # pragma: no cover - redis is optional
+    aioredis = None
+
+logger = logging.getLogger(__name__)
+
+_settings = get_settings()
+SECRET_KEY = _settings.secret_key
+ALGORITHM = _settings.algorithm
+REDIS_URL = _settings.redis_url
+
+USER_RATE = _settings.rate_limit_user_per_second
+USER_BURST = _settings.rate_limit_user_burst
+IP_RATE = _settings.rate_limit_ip_per_second
+IP_BURST = _settings.rate_limit_ip_burst
+TRUST_PROXY = _settings.admission_trust_proxy
+PROXY_HOPS = _settings.admission_proxy_hops
+
+INITIAL_LIMIT = _settings.admission_initial_limit
+MIN_LIMIT = _settings.admission_min_limit
+MAX_LIMIT = _settings.admission_max_limit
+TARGET_LATENCY = _settings.admission_target_latency_seconds
+BACKOFF_RATIO = _settings.admission_backoff_ratio
+
+EXEMPT_PATHS = {"/health", "/ready", "/metrics"}
+
+# Metrics
+ADMISSION_REJECTIONS = Counter(
+    'admission_rejections_total',
+    'Requests rejected by admission control',
+    ['reason']
+)
+
+CONCURRENCY_LIMIT = Gauge(
+    'admission_concurrency_limit',
+    'Current adaptive concurrency limit'
+)
+
+INFLIGHT_REQUESTS = Gauge(
+    'admission_inflight_requests',
+    'Requests currently admitted and in flight'
+)
+
+
+class LocalBucketStore:
+    """In-process token buckets keyed by client identity."""
+
+    def __init__(self, max_keys: int = 100_000):
+        self.max_keys = max_keys
+        self.buckets = {}
+
+    async def consume(self, key: str, rate: float, burst: float) -> float:
+        """Take one token from ``key``'s bucket.
+
+        Returns 0 when the request is allowed, otherwise the number of
+        seconds until a token becomes available.
+        """
+        now = time.monotonic()
+        tokens, updated = self.buckets.get(key, (burst, now))
+        tokens = min(burst, tokens + (now - updated) * rate)
+        if tokens < 1:
+            self.buckets[key] = (tokens, now)
+            return (1 - tokens) / rate
+        if key not in self.buckets and len(self.buckets) >= self.max_keys:
+            self._evict(now)
+        self.buckets[key] = (tokens - 1, now)
+        return 0.0
+
+    def _evict(self, now: float) -> None:
+        """Drop buckets idle long enough to have refilled completely."""
+        idle = max(USER_BURST / USER_RATE, IP_BURST / IP_RATE)
+        self.buckets = {
+            key: value for key, value in self.buckets.items() if now - value[1] < idle
+        }
+        if len(self.buckets) >= self.max_keys:
+            self.buckets.clear()
+
+
+class RedisBucketStore:
+    """Token buckets kept in Redis so that all replicas share the same state."""
+
+    # Refill and take atomically; returns the wait time in milliseconds
+    SCRIPT = """
+    local rate = tonumber(ARGV[1])
+    local burst = tonumber(ARGV[2])
+    local now = tonumber(ARGV[3])
+    local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+    local tokens = tonumber(state[1]) or burst
+    local updated = tonumber(state[2]) or now
+    tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+    local wait = 0
+    if tokens < 1 then
+        wait = math.ceil((1 - tokens) / rate * 1000)
+    else
+        tokens = tokens - 1
+    end
+    redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+    redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+    return wait
+    """
+
+    def __init__(self, url: str, fallback: LocalBucketStore):
+        self.client = aioredis.from_url(url)
+        self.script = self.client.register_script(self.SCRIPT)
+        self.fallback = fallback
+
+    async def consume(self, key: str, rate: float, burst: float) -> float:
+        """Take one token from ``key``'s shared bucket, see ``LocalBucketStore``."""
+        try:
+            wait = await self.script(keys=[f"ratelimit:{key}"], args=[rate, burst, time.time()])
+            return int(wait) / 1000
+        except Exception as e:  # pylint: disable=broad-except
+            # Keep limiting per replica rather than failing requests when Redis is down
+            logger.warning("Redis rate limiting unavailable: %s", str(e))
+            return await self.fallback.consume(key, rate, burst)
+
+
+# Route marker: release the slot without adjusting the limit
+NO_TARGET = object()
+
+
+class AdaptiveLimiter:
+    """AIMD concurrency limit driven by observed request latency.
+
+    The limit grows by roughly one per limit's worth of fast requests and is
+    cut by ``backoff`` when a request is slower than its target or fails. As
+    in TCP congestion control, the limit is cut at most once per window: only
+    requests started after the previous cut can cut it again, so a burst of
+    slow requests that were already in flight counts as a single signal.
+    """
+
+    def __init__(self, initial: float, minimum: float, maximum: float, target: float, backoff: float):
+        self.limit = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target = target
+        self.backoff = backoff
+        self.inflight = 0
+        self.last_decrease = float("-inf")
+        CONCURRENCY_LIMIT.set(self.limit)
+
+    def try_acquire(self) -> bool:
+        """Admit a request if the current limit allows it."""
+        if self.inflight >= int(self.limit):
+            return False
+        self.inflight += 1
+        INFLIGHT_REQUESTS.set(self.inflight)
+        return True
+
+    def release(self, started_at: float, failed: bool, target: Optional[float] = None) -> None:
+        """Release a slot and adjust the limit from the request outcome.
+
+        ``started_at`` is the ``time.monotonic()`` value when the request was
+        admitted. ``target`` overrides the latency target for this request;
+        ``NO_TARGET`` releases the slot without adjusting the limit.
+        """
+        self.inflight -= 1
+        INFLIGHT_REQUESTS.set(self.inflight)
+        if target is NO_TARGET:
+            return
+        now = time.monotonic()
+        if failed or now - started_at > (target or self.target):
+            if started_at >= self.last_decrease:
+                self.limit = max(self.minimum, self.limit * self.backoff)
+                self.last_decrease = now
+        else:
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+        CONCURRENCY_LIMIT.set(self.limit)
+
+    def retry_after(self) -> float:
+        """Rough estimate of when a slot will be free."""
+        return self.target
+
+
+def latency_target(seconds: Optional[float]):
+    """Give a route its own latency target for the adaptive limit.
+
+    Apply right below the route decorator. ``None`` keeps the route out of
+    the limit's adjustments entirely, for long-running endpoints whose
+    latency says nothing about overload.
+    """
+    def decorator(func):
+        func.admission_target = NO_TARGET if seconds is None else seconds
+        return func
+    return decorator
+
+
+_local_store = LocalBucketStore()
+bucket_store = (
+    RedisBucketStore(REDIS_URL, _local_store) if REDIS_URL and aioredis is not None else _local_store
+)
+limiter = AdaptiveLimiter(INITIAL_LIMIT, MIN_LIMIT, MAX_LIMIT, TARGET_LATENCY, BACKOFF_RATIO)
+
+
+def client_ip(request: Request) -> str:
+    """Return the client address, honouring the gateway's forwarding headers.
+
+    Each of the ``PROXY_HOPS`` trusted proxies in front of the service appends
+    the address it received the request from to ``X-Forwarded-For``, so the
+    client address is the entry that many positions from the right. Entries
+    further left are supplied by the client and cannot be trusted.
+    """
+    peer = request.client.host if request.client else "unknown"
+    if not TRUST_PROXY or PROXY_HOPS < 1:
+        return peer
+    forwarded = [
+        address.strip()
+        for header in request.headers.getlist("X-Forwarded-For")
+        for address in header.split(",")
+        if address.strip()
+    ]
+    if len(forwarded) < PROXY_HOPS:
+        return peer
+    return forwarded[-PROXY_HOPS]
+
+
+def token_subject(request: Request) -> Optional[str]:
+    """Return the ``sub`` claim of a valid bearer token, if any."""
+    token = request.headers.get("Authorization")
+    if not token or not token.startswith("Bearer "):
+        return None
+    try:
+        payload = jwt.decode(token.split("Bearer ")[1].encode(), SECRET_KEY.encode(), algorithms=[ALGORITHM])
+    except jwt.PyJWTError:
+        return None
+    return payload.get("sub")
+
+
+def reject(status_code: int, reason: str, retry_after: float) -> Response:
+    """Build a fail-fast rejection response with a ``Retry-After`` header."""
+    ADMISSION_REJECTIONS.labels(reason=reason).inc()
+    return JSONResponse(
+        status_code=status_code,
+        content={"detail": "Too many requests" if status_code == 429 else "Service overloaded"},
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+    )
+
+
+def setup_admission_control(app: FastAPI) -> None:
+    """Setup rate limiting and adaptive concurrency limiting for a FastAPI application.
+
+    Call this before ``setup_metrics`` so that rejected requests are still
+    counted by the request metrics.
+    """
+
+    @app.middleware("http")
+    async def admission_middleware(request: Request, call_next: Callable) -> Response:
+        """Middleware to reject requests over the rate or concurrency limits."""
+        if route_path(request.scope) in EXEMPT_PATHS:
+            return await call_next(request)
+
+        subject = token_subject(request)
+        if subject is not None:
+            wait = await bucket_store.consume(f"user:{subject}", USER_RATE, USER_BURST)
+            if wait:
+                return reject(429, "user_rate", wait)
+        wait = await bucket_store.consume(f"ip:{client_ip(request)}", IP_RATE, IP_BURST)
+        if wait:
+            return reject(429, "ip_rate", wait)
+
+        if not limiter.try_acquire():
+            return reject(503, "concurrency", limiter.retry_after())
+
+        started_at = time.monotonic()
+        failed = True
+        try:
+            response = await call_next(request)
+            failed = response.status_code >= 500
+            return response
+        finally:
+            route = request.scope.get("route")
+            target = getattr(getattr(route, "endpoint", None), "admission_target", None)
+            limiter.release(started_at, failed, target)
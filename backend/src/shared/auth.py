@@ -1,17 +1,19 @@
 """Authentication and authorization utilities for the application."""
-import os
 from functools import wraps
 
-from dotenv import load_dotenv
 from fastapi import HTTPException, Request
 from pydantic import BaseModel
 import jwt
 
-load_dotenv()
+from .profiling import profile_stage
+from .revocation import revocation_cache
+from .settings import get_settings
+from .tracing import start_span
 
-SECRET_KEY=os.getenv("SECRET_KEY")
-ALGORITHM=os.getenv("ALGORITHM")
-ACCESS_TOKEN_EXPIRE_MINUTES=float(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES"))
+_settings = get_settings()
+SECRET_KEY=_settings.secret_key
+ALGORITHM=_settings.algorithm
+ACCESS_TOKEN_EXPIRE_MINUTES=_settings.access_token_expire_minutes
 
 class User(BaseModel):
     """User model with role information."""
@@ -41,11 +43,16 @@ def authenticate_user(func):
         token = token.split("Bearer ")[1]
 
         try:
-            payload = jwt.decode(token.encode(), SECRET_KEY.encode(), algorithms=[ALGORITHM])
+            with profile_stage("jwt_decode"), start_span("auth.decode"):
+                payload = jwt.decode(token.encode(), SECRET_KEY.encode(), algorithms=[ALGORITHM])
+            await revocation_cache.ensure_started()
+            if revocation_cache.is_revoked(payload):
+                raise HTTPException(status_code=401, detail="Token revoked")
             request.state.user = {
                 "username": payload.get("sub"),
                 "role": payload.get("role")
             }
+            request.state.token = payload
             return await func(*args, request=request, **kwargs)
         except jwt.ExpiredSignatureError as exc:
             raise HTTPException(status_code=401, detail="Token expired") from exc
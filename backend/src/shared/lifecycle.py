@@ -0,0 +1,82 @@
+"""Startup, shutdown and readiness handling shared by all services."""
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse
+
+from ..services import database
+from .revocation import revocation_cache
+from .settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Warm up the database pool and the revocation cache before serving.
+
+    A database that is down at startup does not stop the process: the
+    readiness probe keeps reporting it until the database is reachable.
+    """
+    try:
+        await run_in_threadpool(database.warm_up)
+    except Exception as e:  # pylint: disable=broad-except
+        logger.error("Database warm-up failed: %s", str(e))
+    await revocation_cache.ensure_started()
+    yield
+    await revocation_cache.stop()
+    database.dispose_engine()
+
+
+class ReadinessCheck:
+    """Database connectivity check whose result is cached for a short time.
+
+    Probes from kubelet and the gateway then cost at most one query per
+    ``cache_seconds``, however often they arrive.
+    """
+
+    def __init__(self, cache_seconds: float, timeout: float):
+        self.cache_seconds = cache_seconds
+        self.timeout = timeout
+        self.checked_at = None
+        self.result = None
+        self.lock = None
+
+    async def check(self) -> dict:
+        """Return the cached result, running the check if it is stale."""
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        async with self.lock:
+            now = time.monotonic()
+            if self.checked_at is None or now - self.checked_at >= self.cache_seconds:
+                self.result = await self._run()
+                self.checked_at = time.monotonic()
+            return self.result
+
+    async def _run(self) -> dict:
+        try:
+            await asyncio.wait_for(run_in_threadpool(database.check_connection), self.timeout)
+            status = {"ready": True, "database": "ok"}
+        except asyncio.TimeoutError:
+            status = {"ready": False, "database": "timeout"}
+        except Exception as e:  # pylint: disable=broad-except
+            logger.warning("Readiness check failed: %s", str(e))
+            status = {"ready": False, "database": "unavailable"}
+        status["pool"] = database.pool_status()
+        return status
+
+
+def setup_readiness(app: FastAPI) -> None:
+    """Add a ``/ready`` endpoint that only succeeds when the service can serve."""
+    settings = get_settings()
+    readiness = ReadinessCheck(settings.readiness_cache_seconds, settings.readiness_timeout_seconds)
+
+    @app.get("/ready", include_in_schema=False)
+    async def ready():
+        """Readiness probe checking database connectivity."""
+        status = await readiness.check()
+        return JSONResponse(status_code=200 if status["ready"] else 503, content=status)
@@ -1,9 +1,13 @@
 """Prometheus instrumentation for FastAPI applications."""
-from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
+from prometheus_client import REGISTRY, Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
+from prometheus_client.openmetrics import exposition as openmetrics
 from fastapi import FastAPI, Request, Response
 from typing import Callable
 import time
 
+from .tracing import current_exemplar
+from ..services.database import track_connection_usage
+
 # Metrics
 REQUEST_COUNT = Counter(
     'http_requests_total', 
@@ -17,6 +21,13 @@ REQUEST_LATENCY = Histogram(
     ['method', 'endpoint']
 )
 
+DB_CONNECTION_HOLD = Histogram(
+    'db_connection_hold_seconds',
+    'Time database connections were held per HTTP request',
+    ['method', 'endpoint'],
+    buckets=(0, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, float("inf"))
+)
+
 def setup_metrics(app: FastAPI) -> None:
     """Setup Prometheus metrics middleware and endpoint for a FastAPI application."""
     
@@ -24,17 +35,22 @@ def setup_metrics(app: FastAPI) -> None:
     async def metrics_middleware(request: Request, call_next: Callable) -> Response:
         """Middleware to track request count and latency."""
         start_time = time.time()
+        connection_usage = track_connection_usage()
         
         # Process the request
         response = await call_next(request)
         
-        # Record request latency
+        # Record request latency, linked to the trace when it is sampled
         latency = time.time() - start_time
         endpoint = request.url.path
         REQUEST_LATENCY.labels(
             method=request.method, 
             endpoint=endpoint
-        ).observe(latency)
+        ).observe(latency, exemplar=current_exemplar())
+        DB_CONNECTION_HOLD.labels(
+            method=request.method,
+            endpoint=endpoint
+        ).observe(connection_usage.hold_seconds())
         
         # Record request count
         REQUEST_COUNT.labels(
@@ -45,10 +61,20 @@ def setup_metrics(app: FastAPI) -> None:
         
         return response
     
-    @app.get("/metrics", include_in_schema=False)
-    async def metrics() -> Response:
-        """Endpoint that exposes Prometheus metrics."""
+    app.add_api_route("/metrics", metrics, methods=["GET"], include_in_schema=False)
+
+async def metrics(request: Request) -> Response:
+    """Endpoint that exposes Prometheus metrics.
+
+    Exemplars are only part of the OpenMetrics format, which is served
+    when the scraper asks for it.
+    """
+    if "application/openmetrics-text" in request.headers.get("Accept", ""):
         return Response(
-            content=generate_latest(),
-            media_type=CONTENT_TYPE_LATEST
-        )
\ No newline at end of file
+            content=openmetrics.generate_latest(REGISTRY),
+            media_type=openmetrics.CONTENT_TYPE_LATEST
+        )
+    return Response(
+        content=generate_latest(),
+        media_type=CONTENT_TYPE_LATEST
+    )
\ No newline at end of file
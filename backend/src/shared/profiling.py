@@ -0,0 +1,356 @@
+"""On-demand request profiling for FastAPI applications.
+
+A request is profiled when it carries ``X-Profile: 1`` together with an admin
+token, or when it is picked by ``PROFILE_SAMPLE_RATE``. While profiled, a
+background thread samples the event loop thread's stack (a statistical,
+wall-clock profile) and ``profile_stage`` blocks record the time spent in each
+stage (route handler, JWT decode, SQL, ORM, serialization, ...). Stages may
+nest; each one records only the time not spent in the stages nested in it. The last ``PROFILE_HISTORY`` profiles are kept in
+memory and exposed in speedscope format on ``/debug/profiles``.
+
+When no request is being profiled the middleware only reads one header and
+``profile_stage`` only reads one context variable.
+"""
+import asyncio
+import contextvars
+import itertools
+import random
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import nullcontext
+from functools import wraps
+from typing import Callable, Optional
+
+import jwt
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from .revocation import revocation_cache
+from .routing import route_path
+from .settings import get_settings
+
+_settings = get_settings()
+SECRET_KEY = _settings.secret_key
+ALGORITHM = _settings.algorithm
+
+PROFILE_SAMPLE_RATE = _settings.profile_sample_rate
+PROFILE_INTERVAL = _settings.profile_interval_seconds
+PROFILE_HISTORY = _settings.profile_history
+PROFILE_HEADER = b"x-profile"
+ADMIN_ROLES = ("admin", "superadmin")
+
+EXCLUDED_PATHS = ("/metrics", "/ready", "/debug/profiles")
+
+_current_profile = contextvars.ContextVar("current_profile", default=None)
+_profile_ids = itertools.count(1)
+profiles = deque(maxlen=PROFILE_HISTORY)
+
+
+class RequestProfile:
+    """Stack samples and stage timings collected for one request."""
+
+    def __init__(self, method: str, path: str, trigger: str):
+        self.id = next(_profile_ids)
+        self.method = method
+        self.path = path
+        self.trigger = trigger
+        self.thread_id = threading.get_ident()
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.wall = None
+        self.status_code = None
+        self.stages = {}
+        self.open_stages = []
+        self.samples = []
+        self.last_sample = self.start
+
+    def add_stage(self, name: str, duration: float, nested: float = 0.0) -> None:
+        """Accumulate time spent in a stage, minus the ``nested`` stages' time."""
+        if self.open_stages:
+            self.open_stages[-1] += duration
+        total, count = self.stages.get(name, (0.0, 0))
+        self.stages[name] = (total + duration - nested, count + 1)
+
+    def add_sample(self, frame, now: float) -> None:
+        """Record the stack of ``frame`` weighted by the time since the last sample."""
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+            frame = frame.f_back
+        stack.reverse()
+        self.samples.append((tuple(stack), now - self.last_sample))
+        self.last_sample = now
+
+    def summary(self) -> dict:
+        """Wall time and per-stage breakdown of the request."""
+        stages = {
+            name: {"seconds": round(total, 6), "count": count}
+            for name, (total, count) in self.stages.items()
+        }
+        # Nested time is only counted once, so the sum is the attributed time
+        attributed = sum(total for total, _ in self.stages.values())
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "trigger": self.trigger,
+            "status_code": self.status_code,
+            "started_at": self.started_at,
+            "wall_seconds": round(self.wall or 0.0, 6),
+            "unattributed_seconds": round(max(0.0, (self.wall or 0.0) - attributed), 6),
+            "stages": stages,
+            "samples": len(self.samples),
+        }
+
+    def speedscope(self) -> dict:
+        """Export the samples in speedscope's sampled-profile format."""
+        frames, index = [], {}
+        samples, weights = [], []
+        for stack, weight in self.samples:
+            indices = []
+            for key in stack:
+                if key not in index:
+                    index[key] = len(frames)
+                    frames.append({"name": key[0], "file": key[1], "line": key[2]})
+                indices.append(index[key])
+            samples.append(indices)
+            weights.append(weight)
+        name = f"{self.method} {self.path} #{self.id}"
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": name,
+            "exporter": "backend.shared.profiling",
+            "shared": {"frames": frames},
+            "profiles": [{
+                "type": "sampled",
+                "name": name,
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": sum(weights),
+                "samples": samples,
+                "weights": weights,
+            }],
+        }
+
+
+class StackSampler:
+    """Background thread sampling the threads that run profiled requests.
+
+    The thread only runs while at least one request is being profiled.
+    Concurrent requests on the same event loop share its stack, so each
+    profile also contains samples taken while other requests were running.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.active = set()
+        self.thread = None
+
+    def add(self, profile: RequestProfile) -> None:
+        """Start sampling for ``profile``."""
+        with self.lock:
+            self.active.add(profile)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="stack-sampler", daemon=True)
+                self.thread.start()
+
+    def remove(self, profile: RequestProfile) -> None:
+        """Stop sampling for ``profile``."""
+        with self.lock:
+            self.active.discard(profile)
+
+    def run(self) -> None:
+        """Sample until no profiles are active."""
+        while True:
+            with self.lock:
+                if not self.active:
+                    self.thread = None
+                    return
+                active = list(self.active)
+            frames = sys._current_frames()  # pylint: disable=protected-access
+            now = time.perf_counter()
+            for profile in active:
+                frame = frames.get(profile.thread_id)
+                if frame is not None:
+                    profile.add_sample(frame, now)
+            del frames
+            time.sleep(self.interval)
+
+
+sampler = StackSampler(PROFILE_INTERVAL)
+
+
+class _Stage:
+    """Context manager adding its duration to the active profile."""
+
+    __slots__ = ("profile", "name", "start")
+
+    def __init__(self, profile: RequestProfile, name: str):
+        self.profile = profile
+        self.name = name
+
+    def __enter__(self):
+        self.profile.open_stages.append(0.0)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        duration = time.perf_counter() - self.start
+        self.profile.add_stage(self.name, duration, self.profile.open_stages.pop())
+        return False
+
+
+_NO_STAGE = nullcontext()
+
+
+def profile_stage(name: str):
+    """Time a block as stage ``name`` of the current profile, if any."""
+    profile = _current_profile.get()
+    if profile is None:
+        return _NO_STAGE
+    return _Stage(profile, name)
+
+
+def _profiled_endpoint(endpoint: Callable) -> Callable:
+    """Wrap a route function so that its body is recorded as the ``handler`` stage."""
+    if asyncio.iscoroutinefunction(endpoint):
+        @wraps(endpoint)
+        async def async_wrapper(*args, **kwargs):
+            with profile_stage("handler"):
+                return await endpoint(*args, **kwargs)
+        return async_wrapper
+
+    @wraps(endpoint)
+    def wrapper(*args, **kwargs):
+        with profile_stage("handler"):
+            return endpoint(*args, **kwargs)
+    return wrapper
+
+
+class ProfiledRoute(APIRoute):
+    """Route recording FastAPI's own work as the ``serialization`` stage.
+
+    That is everything the route does outside the handler: parsing and
+    validating the request, and validating and serializing the response.
+    """
+
+    def __init__(self, path: str, endpoint: Callable, **kwargs):
+        super().__init__(path, _profiled_endpoint(endpoint), **kwargs)
+
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+
+        async def profiled_handler(request: Request):
+            with profile_stage("serialization"):
+                return await handler(request)
+        return profiled_handler
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    """Remember when a statement started for the active profile."""
+    if _current_profile.get() is not None:
+        conn.info["profile_query_start"] = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    """Add the statement's execution time to the ``sql`` stage."""
+    profile = _current_profile.get()
+    start = conn.info.pop("profile_query_start", None)
+    if profile is not None and start is not None:
+        profile.add_stage("sql", time.perf_counter() - start)
+
+
+def _is_admin_token(authorization: Optional[bytes]) -> bool:
+    """Check whether an ``Authorization`` header carries a valid admin token."""
+    if not authorization or not authorization.startswith(b"Bearer "):
+        return False
+    try:
+        payload = jwt.decode(authorization[7:], SECRET_KEY.encode(), algorithms=[ALGORITHM])
+    except jwt.PyJWTError:
+        return False
+    return payload.get("role") in ADMIN_ROLES and not revocation_cache.is_revoked(payload)
+
+
+class ProfilingMiddleware:
+    """ASGI middleware deciding which requests to profile.
+
+    Written as plain ASGI rather than ``@app.middleware("http")`` so that the
+    common, unprofiled path costs a header lookup and nothing else.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or route_path(scope).startswith(EXCLUDED_PATHS):
+            await self.app(scope, receive, send)
+            return
+
+        trigger = None
+        headers = dict(scope["headers"])
+        if headers.get(PROFILE_HEADER) == b"1" and _is_admin_token(headers.get(b"authorization")):
+            trigger = "header"
+        elif PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+            trigger = "sample"
+        if trigger is None:
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile(scope["method"], scope["path"], trigger)
+
+        async def send_with_profile(message):
+            if message["type"] == "http.response.start":
+                profile.status_code = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"x-profile-id", str(profile.id).encode())
+                ]
+            await send(message)
+
+        token = _current_profile.set(profile)
+        sampler.add(profile)
+        try:
+            await self.app(scope, receive, send_with_profile)
+        finally:
+            sampler.remove(profile)
+            _current_profile.reset(token)
+            profile.wall = time.perf_counter() - profile.start
+            profiles.append(profile)
+
+
+def _find_profile(profile_id: int) -> RequestProfile:
+    for profile in profiles:
+        if profile.id == profile_id:
+            return profile
+    raise HTTPException(status_code=404, detail="Profile not found")
+
+
+def setup_profiling(app: FastAPI) -> None:
+    """Setup the profiling middleware and admin endpoints for a FastAPI application."""
+    # Imported here because shared.auth itself uses profile_stage
+    from .auth import authenticate_user, authorize_roles  # pylint: disable=import-outside-toplevel
+
+    app.add_middleware(ProfilingMiddleware)
+    # Routes declared from now on record the handler and serialization stages
+    app.router.route_class = ProfiledRoute
+
+    @app.get("/debug/profiles", include_in_schema=False)
+    @authenticate_user
+    @authorize_roles(*ADMIN_ROLES)
+    async def list_profiles(request: Request):
+        """List the most recent request profiles, newest first."""
+        return [profile.summary() for profile in reversed(profiles)]
+
+    @app.get("/debug/profiles/{profile_id}", include_in_schema=False)
+    @authenticate_user
+    @authorize_roles(*ADMIN_ROLES)
+    async def get_profile(profile_id: int, request: Request):
+        """Return one profile in speedscope format."""
+        return _find_profile(profile_id).speedscope()
@@ -0,0 +1,198 @@
+"""In-memory view of revoked JWTs.
+
+``auth`` records revoked token ids (``jti``) and per-user "tokens issued
+before" cutoffs in the ``token_revocations`` table. Every service mirrors that
+table in memory and only reads the rows added since its last refresh, so
+checking a token on the request path never touches the database: a bloom
+filter answers "definitely not revoked" for almost every token and the exact
+set settles the rare positive.
+"""
+import asyncio
+import hashlib
+import logging
+import math
+import time
+from datetime import datetime, timedelta, timezone
+
+from fastapi.concurrency import run_in_threadpool
+
+from .settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+_settings = get_settings()
+TOKEN_LIFETIME = _settings.access_token_expire_minutes * 60
+REFRESH_INTERVAL = _settings.revocation_refresh_seconds
+REFRESH_OVERLAP = _settings.revocation_overlap_seconds
+BLOOM_CAPACITY = _settings.revocation_bloom_capacity
+BLOOM_ERROR_RATE = _settings.revocation_bloom_error_rate
+
+
+class BloomFilter:
+    """Fixed-size bloom filter over strings."""
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.capacity = capacity
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item: str):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        return ((first + i * second) % self.size for i in range(self.hashes))
+
+    def add(self, item: str) -> None:
+        """Add ``item`` to the filter."""
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+def _timestamp(value) -> float:
+    """Convert a naive UTC datetime from the database to a UNIX timestamp."""
+    return value.replace(tzinfo=timezone.utc).timestamp()
+
+
+class RevocationCache:
+    """Revoked token ids and per-user cutoffs, refreshed in the background."""
+
+    def __init__(self, capacity: int = BLOOM_CAPACITY, error_rate: float = BLOOM_ERROR_RATE):
+        self.error_rate = error_rate
+        self.bloom = BloomFilter(capacity, error_rate)
+        self.revoked = {}
+        self.cutoffs = {}
+        self.last_id = 0
+        self.loaded = False
+        self.task = None
+        self.lock = None
+
+    def is_revoked(self, payload: dict) -> bool:
+        """Check a decoded token against the revocations seen so far."""
+        cutoff = self.cutoffs.get(payload.get("sub"))
+        if cutoff is not None and payload.get("iat", 0) < cutoff:
+            return True
+        jti = payload.get("jti")
+        return jti is not None and jti in self.bloom and jti in self.revoked
+
+    def revoke_token(self, jti: str, expires_at: float) -> None:
+        """Record a revoked token id."""
+        if jti in self.revoked:
+            return
+        if self.bloom.count >= self.bloom.capacity:
+            self._rebuild(self.bloom.capacity * 2)
+        self.revoked[jti] = expires_at
+        self.bloom.add(jti)
+
+    def revoke_user(self, username: str, issued_before: float) -> None:
+        """Record that every token of ``username`` issued before a moment is revoked."""
+        self.cutoffs[username] = max(issued_before, self.cutoffs.get(username, 0))
+
+    def apply(self, rows) -> None:
+        """Merge rows of the ``token_revocations`` table."""
+        for row in rows:
+            self.last_id = max(self.last_id, row.id)
+            if row.jti:
+                self.revoke_token(row.jti, _timestamp(row.expires_at) if row.expires_at else math.inf)
+            if row.username and row.issued_before:
+                self.revoke_user(row.username, _timestamp(row.issued_before))
+
+    def prune(self) -> None:
+        """Forget revocations whose tokens have all expired."""
+        now = time.time()
+        expired = [jti for jti, expires_at in self.revoked.items() if expires_at < now]
+        for jti in expired:
+            del self.revoked[jti]
+        self.cutoffs = {
+            username: cutoff for username, cutoff in self.cutoffs.items()
+            if cutoff + TOKEN_LIFETIME > now
+        }
+        # Removed ids stay set in the bloom filter until it is rebuilt
+        if expired and len(self.revoked) < self.bloom.count // 2:
+            self._rebuild(self.bloom.capacity)
+
+    def _rebuild(self, capacity: int) -> None:
+        bloom = BloomFilter(max(capacity, len(self.revoked) * 2), self.error_rate)
+        for jti in self.revoked:
+            bloom.add(jti)
+        self.bloom = bloom
+
+    def _load(self) -> list:
+        """Read the revocations added since the last refresh."""
+        # Imported here to keep the database out of modules that only check tokens
+        from ..services import crud  # pylint: disable=import-outside-toplevel
+        from ..services.database import create_session  # pylint: disable=import-outside-toplevel
+
+        db = create_session()
+        try:
+            if self.loaded:
+                # Ids are assigned at insert but may commit out of order, so a row
+                # below last_id can appear after a refresh. Rows of the last moments
+                # are read again; apply ignores those already seen.
+                recent = datetime.utcnow() - timedelta(seconds=REFRESH_OVERLAP)
+                return crud.get_token_revocations(db, after_id=self.last_id, recent_since=recent)
+            # Older revocations only concern tokens that have expired by now. Start
+            # the next refreshes after the newest row, even if it is one of those,
+            # so that they never read the history again. The maximum is read first:
+            # rows added in between are recent and returned by the query below.
+            last_id = crud.get_last_token_revocation_id(db)
+            since = datetime.utcnow() - timedelta(seconds=TOKEN_LIFETIME)
+            rows = crud.get_token_revocations(db, after_id=self.last_id, since=since)
+            self.last_id = max(self.last_id, last_id)
+            return rows
+        finally:
+            db.close()
+
+    async def refresh(self) -> None:
+        """Load new revocations from the database."""
+        self.apply(await run_in_threadpool(self._load))
+        self.prune()
+        self.loaded = True
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(REFRESH_INTERVAL)
+            try:
+                await self.refresh()
+            except Exception as e:  # pylint: disable=broad-except
+                logger.error("Error refreshing token revocations: %s", str(e))
+
+    async def ensure_started(self) -> None:
+        """Load the revocations once and start the background refresh.
+
+        Cheap after the first call. If the first load fails tokens are
+        accepted and the background task keeps retrying.
+        """
+        if self.task is not None and not self.task.done():
+            return
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        async with self.lock:
+            if self.task is not None and not self.task.done():
+                return
+            try:
+                await self.refresh()
+            except Exception as e:  # pylint: disable=broad-except
+                logger.error("Error loading token revocations: %s", str(e))
+            self.task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        """Cancel the background refresh."""
+        if self.task is None:
+            return
+        task, self.task = self.task, None
+        task.cancel()
+        if task.get_loop() is not asyncio.get_running_loop():
+            return
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+
+revocation_cache = RevocationCache()
@@ -0,0 +1,15 @@
+"""Helpers for services that may be mounted under a path prefix."""
+
+
+def route_path(scope) -> str:
+    """Return the request path relative to the application.
+
+    Mounted applications (see ``monolith``) receive the full path, with the
+    mount prefix in ``root_path``; paths such as ``/health`` must be compared
+    without it.
+    """
+    path = scope["path"]
+    root_path = scope.get("root_path", "")
+    if root_path and path.startswith(root_path):
+        return path[len(root_path):] or "/"
+    return path
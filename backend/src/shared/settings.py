@@ -0,0 +1,109 @@
+"""Centralized service configuration.
+
+The ``.env`` file and the environment are read once, on the first call to
+``get_settings``, instead of every module calling ``load_dotenv`` at import.
+Each field is read from the environment variable with the upper-cased name.
+"""
+import os
+from functools import lru_cache
+from typing import Optional
+
+from dotenv import load_dotenv
+from pydantic import BaseModel
+
+
+class Settings(BaseModel):
+    """Configuration shared by all services."""
+    # Authentication
+    secret_key: Optional[str] = None
+    algorithm: Optional[str] = None
+    access_token_expire_minutes: float = 30
+
+    # Database
+    postgres_user: str = "admin"
+    postgres_password: str = "admin"
+    postgres_host: str = "postgres"
+    postgres_port: int = 5432
+    postgres_db: str = "app"
+    db_pool_size: int = 5
+    db_max_overflow: int = 10
+    db_pool_timeout: float = 30
+    db_warm_connections: int = 1
+    readiness_cache_seconds: float = 2
+    readiness_timeout_seconds: float = 2
+
+    # Admission control
+    redis_url: Optional[str] = None
+    rate_limit_user_per_second: float = 20
+    rate_limit_user_burst: float = 40
+    rate_limit_ip_per_second: float = 50
+    rate_limit_ip_burst: float = 100
+    admission_trust_proxy: bool = False
+    admission_proxy_hops: int = 1
+    admission_initial_limit: float = 20
+    admission_min_limit: float = 2
+    admission_max_limit: float = 200
+    admission_target_latency_seconds: float = 0.5
+    admission_backoff_ratio: float = 0.9
+
+    # Profiling
+    profile_sample_rate: float = 0
+    profile_interval_seconds: float = 0.005
+    profile_history: int = 20
+
+    # Tracing
+    service_name: str = "backend"
+    trace_sample_ratio: float = 0.01
+    trace_exporter: str = "none"
+    trace_file: str = "spans.jsonl"
+
+    # Token revocation
+    revocation_refresh_seconds: float = 5
+    revocation_overlap_seconds: float = 60
+    revocation_bloom_capacity: int = 100000
+    revocation_bloom_error_rate: float = 0.001
+
+    # Payments
+    payment_provider: str = "stub"
+    payment_provider_url: Optional[str] = None
+    payment_provider_api_key: Optional[str] = None
+    payment_provider_timeout_seconds: float = 5
+    payment_provider_max_connections: int = 100
+    payment_provider_retries: int = 2
+    payment_provider_backoff_seconds: float = 0.2
+    payment_circuit_failure_threshold: int = 5
+    payment_circuit_reset_seconds: float = 30
+    payment_workers: int = 50
+    payment_queue_size: int = 1000
+    payment_sweep_seconds: float = 30
+    payment_webhook_secret: Optional[str] = None
+    payment_stub_latency_seconds: float = 0.05
+    payment_stub_failure_rate: float = 0
+
+    # Order partitions and archival
+    orders_hot_days: int = 90
+    order_aggregate_slots: int = 16
+    orders_partition_months_ahead: int = 2
+    orders_archive_after_days: int = 365
+    orders_archive_dir: Optional[str] = None
+    orders_cold_tablespace: Optional[str] = None
+    orders_archive_drop: bool = False
+
+    @property
+    def database_url(self) -> str:
+        """SQLAlchemy URL of the application database."""
+        return (
+            f"postgresql://{self.postgres_user}:{self.postgres_password}"
+            f"@{self.postgres_host}:{self.postgres_port}/{self.postgres_db}"
+        )
+
+
+@lru_cache(maxsize=None)
+def get_settings() -> Settings:
+    """Load the settings from ``.env`` and the environment, once per process."""
+    load_dotenv()
+    return Settings(**{
+        name: os.environ[name.upper()]
+        for name in Settings.model_fields
+        if name.upper() in os.environ
+    })
@@ -0,0 +1,316 @@
+"""Distributed tracing with W3C ``traceparent`` propagation.
+
+Every service continues the trace started by the gateway (or starts one) and
+records spans for the request handler, JWT decoding, each ``crud`` call and
+each SQL statement. The sampling decision is taken once per trace, from the
+incoming ``traceparent`` flags or from the trace id itself, so unsampled
+requests never allocate spans. Finished spans are handed to a pluggable
+exporter; the in-memory and file exporters are meant for tests and local runs.
+"""
+import contextvars
+import json
+import os
+import threading
+import time
+from collections import deque
+from functools import wraps
+from typing import Optional
+
+from fastapi import FastAPI
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from .routing import route_path
+from .settings import get_settings
+
+_settings = get_settings()
+SERVICE_NAME = _settings.service_name
+TRACE_SAMPLE_RATIO = _settings.trace_sample_ratio
+TRACE_EXPORTER = _settings.trace_exporter
+TRACE_FILE = _settings.trace_file
+
+MAX_STATEMENT_LENGTH = 512
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    """A timed operation belonging to a trace."""
+
+    __slots__ = (
+        "trace_id", "span_id", "parent_id", "name", "kind", "attributes",
+        "status", "start_ns", "end_ns", "_token",
+    )
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str] = None, kind: str = "internal"):
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.attributes = {}
+        self.status = "ok"
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self._token = None
+
+    def set_attribute(self, key: str, value) -> None:
+        """Attach an attribute to the span."""
+        self.attributes[key] = value
+
+    def end(self) -> None:
+        """Finish the span and hand it to the exporter."""
+        self.end_ns = time.time_ns()
+        exporter.export(self)
+
+    def traceparent(self) -> str:
+        """Format the span as a sampled W3C ``traceparent`` header value."""
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def to_dict(self) -> dict:
+        """Serialize the span for exporters."""
+        return {
+            "service": SERVICE_NAME,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "kind": self.kind,
+            "start_time_unix_nano": self.start_ns,
+            "end_time_unix_nano": self.end_ns,
+            "duration_ms": (self.end_ns - self.start_ns) / 1e6 if self.end_ns else None,
+            "attributes": self.attributes,
+            "status": self.status,
+        }
+
+    def __enter__(self):
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc is not None:
+            self.status = "error"
+            self.attributes["error.type"] = exc_type.__name__
+        _current_span.reset(self._token)
+        self.end()
+        return False
+
+
+class SpanExporter:
+    """Base class for span sinks."""
+
+    def export(self, span: Span) -> None:
+        """Receive a finished span."""
+
+
+class InMemoryExporter(SpanExporter):
+    """Keep the most recent finished spans in memory."""
+
+    def __init__(self, max_spans: int = 10_000):
+        self.spans = deque(maxlen=max_spans)
+
+    def export(self, span: Span) -> None:
+        self.spans.append(span.to_dict())
+
+    def clear(self) -> None:
+        """Forget all recorded spans."""
+        self.spans.clear()
+
+
+class FileExporter(SpanExporter):
+    """Append finished spans to a file, one JSON object per line."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = open(path, "a", encoding="utf-8")  # pylint: disable=consider-using-with
+
+    def export(self, span: Span) -> None:
+        line = json.dumps(span.to_dict(), default=str) + "\n"
+        with self.lock:
+            self.file.write(line)
+            self.file.flush()
+
+
+def _default_exporter() -> SpanExporter:
+    if TRACE_EXPORTER == "memory":
+        return InMemoryExporter()
+    if TRACE_EXPORTER == "file":
+        return FileExporter(TRACE_FILE)
+    return SpanExporter()
+
+
+exporter = _default_exporter()
+
+
+def set_exporter(new_exporter: SpanExporter) -> None:
+    """Replace the sink receiving finished spans."""
+    global exporter  # pylint: disable=global-statement
+    exporter = new_exporter
+
+
+def current_span() -> Optional[Span]:
+    """Return the active span of a sampled trace, if any."""
+    return _current_span.get()
+
+
+def current_exemplar() -> Optional[dict]:
+    """Return the Prometheus exemplar linking a metric to the current trace."""
+    span = _current_span.get()
+    if span is None:
+        return None
+    return {"trace_id": span.trace_id}
+
+
+class _NoSpan:
+    """Stand-in returned by ``start_span`` when the trace is not sampled."""
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+def start_span(name: str, **attributes):
+    """Start a child span of the current span.
+
+    Outside of a sampled trace this returns a shared no-op context manager.
+    """
+    parent = _current_span.get()
+    if parent is None:
+        return _NO_SPAN
+    span = Span(name, parent.trace_id, parent.span_id)
+    span.attributes.update(attributes)
+    return span
+
+
+def traced(name: Optional[str] = None):
+    """Decorator recording a span for every call of the decorated function."""
+    def decorator(func):
+        span_name = name or f"{func.__module__.rsplit('.', 1)[-1]}.{func.__name__}"
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if _current_span.get() is None:
+                return func(*args, **kwargs)
+            with start_span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def parse_traceparent(value: Optional[str]):
+    """Parse a W3C ``traceparent`` header into ``(trace_id, parent_id, sampled)``."""
+    if not value:
+        return None
+    parts = value.strip().split("-")
+    if len(parts) < 4 or len(parts[0]) != 2 or parts[0] == "ff":
+        return None
+    trace_id, parent_id, flags = parts[1], parts[2], parts[3]
+    if len(trace_id) != 32 or len(parent_id) != 16 or len(flags) != 2:
+        return None
+    try:
+        sampled = bool(int(flags, 16) & 1)
+        int(trace_id, 16)
+        int(parent_id, 16)
+    except ValueError:
+        return None
+    if trace_id == "0" * 32 or parent_id == "0" * 16:
+        return None
+    return trace_id.lower(), parent_id.lower(), sampled
+
+
+def _sample_new_trace(trace_id: str) -> bool:
+    """Ratio-based sampling on the trace id, consistent across services."""
+    return int(trace_id[16:], 16) < TRACE_SAMPLE_RATIO * (1 << 64)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _start_sql_span(conn, cursor, statement, parameters, context, executemany):
+    """Open a span for each SQL statement of a sampled trace."""
+    parent = _current_span.get()
+    if parent is None:
+        return
+    span = Span("db.query", parent.trace_id, parent.span_id, kind="client")
+    span.attributes["db.system"] = conn.dialect.name
+    span.attributes["db.statement"] = statement[:MAX_STATEMENT_LENGTH]
+    conn.info.setdefault("trace_spans", []).append(span)
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _end_sql_span(conn, cursor, statement, parameters, context, executemany):
+    """Finish the span opened for the statement."""
+    spans = conn.info.get("trace_spans")
+    if spans:
+        spans.pop().end()
+
+
+@event.listens_for(Engine, "handle_error")
+def _fail_sql_span(context):
+    """Finish the statement span as failed."""
+    spans = context.connection.info.get("trace_spans") if context.connection is not None else None
+    if spans:
+        span = spans.pop()
+        span.status = "error"
+        span.attributes["error.type"] = type(context.original_exception).__name__
+        span.end()
+
+
+class TracingMiddleware:
+    """ASGI middleware continuing or starting a trace for each HTTP request."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or route_path(scope) in ("/metrics", "/ready"):
+            await self.app(scope, receive, send)
+            return
+
+        incoming = None
+        for key, value in scope["headers"]:
+            if key == b"traceparent":
+                incoming = parse_traceparent(value.decode("latin-1"))
+                break
+        if incoming is not None:
+            trace_id, parent_id, sampled = incoming
+        else:
+            trace_id, parent_id = os.urandom(16).hex(), None
+            sampled = _sample_new_trace(trace_id)
+        if not sampled:
+            await self.app(scope, receive, send)
+            return
+
+        span = Span(f"{scope['method']} {scope['path']}", trace_id, parent_id, kind="server")
+        span.attributes["http.method"] = scope["method"]
+        span.attributes["http.target"] = scope["path"]
+
+        async def send_with_traceparent(message):
+            if message["type"] == "http.response.start":
+                span.attributes["http.status_code"] = message["status"]
+                if message["status"] >= 500:
+                    span.status = "error"
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"traceparent", span.traceparent().encode())
+                ]
+            await send(message)
+
+        with span:
+            await self.app(scope, receive, send_with_traceparent)
+            route = scope.get("route")
+            if route is not None and hasattr(route, "path"):
+                span.name = f"{scope['method']} {route.path}"
+                span.attributes["http.route"] = route.path
+
+
+def setup_tracing(app: FastAPI) -> None:
+    """Setup trace propagation for a FastAPI application.
+
+    Call this after the other ``setup_*`` helpers so that the trace is active
+    in every middleware, including the metrics one that records exemplars.
+    """
+    app.add_middleware(TracingMiddleware)
@@ -0,0 +1,63 @@
+"""Shared fixtures for the backend tests.
+
+The tests run without PostgreSQL: the settings get test values and the
+``db`` fixture binds the sessions to an in-memory SQLite database.
+"""
+import os
+import sys
+import time
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.pool import StaticPool
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("SECRET_KEY", "test-secret")
+os.environ.setdefault("ALGORITHM", "HS256")
+os.environ.setdefault("ACCESS_TOKEN_EXPIRE_MINUTES", "30")
+
+from src.services import crud, database, models  # pylint: disable=wrong-import-position
+
+
+class Clock:
+    """Replacement for ``time.monotonic`` that only moves when told to."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Freeze ``time.monotonic``; advance it with ``clock.now += seconds``."""
+    clock = Clock()
+    monkeypatch.setattr(time, "monotonic", clock)
+    return clock
+
+
+@pytest.fixture
+def db(monkeypatch):
+    """A session on a fresh in-memory SQLite database."""
+    engine = create_engine(
+        "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+    )
+    with engine.begin() as connection:
+        # SQLite cannot autoincrement the (id, created_at) primary key of the
+        # partitioned table, so orders gets a plain integer key here
+        connection.execute(text(
+            "CREATE TABLE orders (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, "
+            "product_id INTEGER, status VARCHAR, amount FLOAT, created_at DATETIME NOT NULL)"
+        ))
+    models.Base.metadata.create_all(engine)
+    monkeypatch.setattr(database, "_engine", engine)
+    monkeypatch.setattr(crud, "insert", sqlite_insert)
+    database.SessionLocal.configure(bind=engine)
+    session = database.SessionLocal()
+    yield session
+    session.close()
+    database.SessionLocal.configure(bind=None)
+    engine.dispose()
@@ -0,0 +1,153 @@
+"""Tests for the client address, the token buckets and the adaptive concurrency limit."""
+import asyncio
+
+import pytest
+from starlette.requests import Request
+
+from src.shared import admission
+from src.shared.admission import NO_TARGET, AdaptiveLimiter, LocalBucketStore, client_ip
+from src.shared.settings import Settings
+
+
+def request_from(peer: str, *forwarded: str) -> Request:
+    headers = [(b"x-forwarded-for", value.encode()) for value in forwarded]
+    return Request({"type": "http", "headers": headers, "client": (peer, 50000)})
+
+
+@pytest.fixture
+def proxy_hops(monkeypatch):
+    """Trust ``hops`` proxies in front of the service."""
+    def configure(hops):
+        monkeypatch.setattr(admission, "TRUST_PROXY", True)
+        monkeypatch.setattr(admission, "PROXY_HOPS", hops)
+    return configure
+
+
+def test_client_ip_is_the_entry_added_by_the_trusted_proxy(proxy_hops):
+    proxy_hops(1)
+    assert client_ip(request_from("10.0.0.2", "6.6.6.6, 1.2.3.4")) == "1.2.3.4"
+
+
+def test_client_ip_counts_the_hops_from_the_right(proxy_hops):
+    proxy_hops(2)
+    assert client_ip(request_from("10.0.0.3", "6.6.6.6, 1.2.3.4, 10.0.0.2")) == "1.2.3.4"
+
+
+def test_client_ip_with_fewer_entries_than_hops(proxy_hops):
+    proxy_hops(2)
+    assert client_ip(request_from("10.0.0.3", "1.2.3.4")) == "10.0.0.3"
+    assert client_ip(request_from("10.0.0.3")) == "10.0.0.3"
+
+
+def test_client_ip_joins_repeated_headers(proxy_hops):
+    proxy_hops(2)
+    request = request_from("10.0.0.3", "6.6.6.6", "1.2.3.4, 10.0.0.2")
+    assert client_ip(request) == "1.2.3.4"
+
+
+def test_client_ip_ignores_the_header_without_a_trusted_proxy(monkeypatch):
+    monkeypatch.setattr(admission, "TRUST_PROXY", False)
+    assert client_ip(request_from("10.0.0.2", "1.2.3.4")) == "10.0.0.2"
+
+
+def test_the_forwarding_header_is_trusted_only_when_enabled():
+    assert not Settings().admission_trust_proxy
+    assert Settings(admission_trust_proxy="true").admission_trust_proxy
+
+
+def consume(store, key, rate=1.0, burst=3.0):
+    return asyncio.run(store.consume(key, rate, burst))
+
+
+def test_bucket_allows_the_burst_then_rejects(clock):
+    store = LocalBucketStore()
+    assert [consume(store, "ip:a") for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert consume(store, "ip:a") == pytest.approx(1.0)
+
+
+def test_bucket_refills_at_the_rate(clock):
+    store = LocalBucketStore()
+    for _ in range(3):
+        consume(store, "ip:a", rate=2.0)
+    assert consume(store, "ip:a", rate=2.0) == pytest.approx(0.5)
+    clock.now += 0.25
+    assert consume(store, "ip:a", rate=2.0) == pytest.approx(0.25)
+    clock.now += 0.25
+    assert consume(store, "ip:a", rate=2.0) == 0.0
+
+
+def test_bucket_never_exceeds_the_burst(clock):
+    store = LocalBucketStore()
+    consume(store, "ip:a")
+    clock.now += 3600
+    assert [consume(store, "ip:a") for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert consume(store, "ip:a") > 0
+
+
+def test_buckets_are_per_key(clock):
+    store = LocalBucketStore()
+    for _ in range(3):
+        consume(store, "ip:a")
+    assert consume(store, "ip:a") > 0
+    assert consume(store, "ip:b") == 0.0
+
+
+def test_bucket_store_evicts_idle_keys(clock):
+    store = LocalBucketStore(max_keys=2)
+    consume(store, "ip:a")
+    consume(store, "ip:b")
+    clock.now += 3600
+    consume(store, "ip:c")
+    assert set(store.buckets) == {"ip:c"}
+
+
+def test_limiter_rejects_over_the_limit(clock):
+    limiter = AdaptiveLimiter(2, 1, 10, 0.1, 0.5)
+    assert limiter.try_acquire() and limiter.try_acquire()
+    assert not limiter.try_acquire()
+    limiter.release(clock(), False)
+    assert limiter.try_acquire()
+
+
+def test_limiter_grows_on_fast_requests(clock):
+    limiter = AdaptiveLimiter(4, 1, 10, 0.1, 0.5)
+    for _ in range(4):
+        limiter.try_acquire()
+        limiter.release(clock(), False)
+    assert limiter.limit == pytest.approx(5, abs=0.2)
+
+
+def test_limiter_cuts_once_per_window(clock):
+    limiter = AdaptiveLimiter(20, 1, 100, 0.1, 0.5)
+    started = clock()
+    for _ in range(20):
+        limiter.try_acquire()
+    clock.now += 1
+    for _ in range(20):
+        limiter.release(started, False)
+    assert limiter.limit == 10
+    # A request admitted after the cut can cut again
+    limiter.try_acquire()
+    started = clock()
+    clock.now += 1
+    limiter.release(started, True)
+    assert limiter.limit == 5
+
+
+def test_limiter_respects_the_minimum(clock):
+    limiter = AdaptiveLimiter(2, 1.5, 10, 0.1, 0.5)
+    limiter.try_acquire()
+    limiter.release(clock(), True)
+    assert limiter.limit == 1.5
+
+
+def test_limiter_route_targets(clock):
+    limiter = AdaptiveLimiter(4, 1, 10, 0.1, 0.5)
+    limiter.try_acquire()
+    started = clock()
+    clock.now += 5
+    limiter.release(started, False, NO_TARGET)
+    assert limiter.limit == 4 and limiter.inflight == 0
+    limiter.try_acquire()
+    limiter.release(started, False, 10.0)
+    assert limiter.limit > 4
@@ -0,0 +1,45 @@
+"""Tests for the export and settlement of archived orders.
+
+The queries are written for one partition of ``orders``; on SQLite they run
+against the whole table.
+"""
+import gzip
+import json
+from datetime import datetime
+
+from src.services import archival, crud, models
+
+
+def make_order(db, status, amount, paid=None):
+    order = models.Order(user_id=1, product_id=1, status=status, amount=amount, created_at=datetime(2020, 1, 5))
+    db.add(order)
+    db.commit()
+    if paid is not None:
+        crud.create_payment(db, order_id=order.id, amount=amount)
+        crud.set_payment_status(db, crud.get_payment_by_order(db, order.id).id, paid)
+    return order
+
+
+def test_export_keeps_the_amount_of_unpaid_orders(db, tmp_path):
+    make_order(db, "paid", 10.0, paid="succeeded")
+    make_order(db, "created", 4.0)
+    path = archival.export_partition(db, "orders", str(tmp_path))
+    with gzip.open(path, "rt", encoding="utf-8") as file:
+        rows = [json.loads(line) for line in file]
+    assert [(row["status"], row["amount"], row["payment_status"]) for row in rows] == [
+        ("paid", 10.0, "succeeded"), ("created", 4.0, None),
+    ]
+    assert rows[0]["payment_amount"] == 10.0
+
+
+def test_unpaid_orders_are_abandoned_before_archiving(db):
+    paid = make_order(db, "paid", 10.0)
+    unpaid = [make_order(db, "created", amount) for amount in (4.0, 6.0)]
+    crud.rebuild_order_aggregates(db)
+    assert archival.abandon_unsettled_orders(db, "orders") == 2
+    db.commit()
+    statuses = dict(db.query(models.Order.id, models.Order.status))
+    assert statuses == {paid.id: "paid", unpaid[0].id: "abandoned", unpaid[1].id: "abandoned"}
+    stats = {row["key"]: (row["orders"], row["revenue"]) for row in crud.get_order_aggregates(db, "status")}
+    assert stats == {"paid": (1, 10.0), "abandoned": (2, 10.0), "created": (0, 0.0)}
+    assert archival.abandon_unsettled_orders(db, "orders") == 0
@@ -0,0 +1,115 @@
+"""Tests for the transaction boundaries and connection accounting of ``crud`` calls."""
+from typing import List
+
+import pytest
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
+from pydantic import BaseModel, ConfigDict, field_validator
+from sqlalchemy import event
+
+from src.services import crud, database, models
+from src.services.database import releases_connection, track_connection_usage
+from src.shared.metrics import setup_metrics
+
+
+@pytest.fixture
+def commits(db):
+    """Count the commits of the session."""
+    counted = []
+    event.listen(db, "after_commit", lambda session: counted.append(session))
+    return counted
+
+
+@releases_connection
+def add_user(db, username):
+    db.add(models.User(username=username, password="x", role="user"))
+    db.flush()
+
+
+@releases_connection
+def add_users(db, *usernames, fail=False):
+    for username in usernames:
+        add_user(db, username)
+        assert db.in_transaction()
+    if fail:
+        raise RuntimeError("failed")
+
+
+def usernames(db):
+    return sorted(username for (username,) in db.query(models.User.username))
+
+
+def test_only_the_outermost_call_commits(db, commits):
+    add_users(db, "a", "b")
+    assert len(commits) == 1
+    assert not db.in_transaction()
+    assert db.info["call_depth"] == 0
+    assert usernames(db) == ["a", "b"]
+
+
+def test_only_the_outermost_call_rolls_back(db, commits):
+    with pytest.raises(RuntimeError):
+        add_users(db, "a", "b", fail=True)
+    assert not commits
+    assert db.info["call_depth"] == 0
+    assert usernames(db) == []
+
+
+def test_inner_errors_handled_by_the_caller_keep_the_transaction(db, commits):
+    @releases_connection
+    def tolerant(db):
+        add_user(db, "a")
+        try:
+            add_users(db, "b", fail=True)
+        except RuntimeError:
+            pass
+
+    tolerant(db)
+    assert len(commits) == 1
+    assert usernames(db) == ["a", "b"]
+
+
+def test_connection_is_returned_after_each_call(db):
+    usage = track_connection_usage()
+    crud.create_user(db, "a", "x")
+    assert usage.checkouts and usage.open == {}
+    checkouts = usage.checkouts
+    assert crud.get_user_by_username(db, "a").username == "a"
+    assert usage.checkouts == checkouts + 1 and usage.open == {}
+    assert usage.held > 0
+
+
+held: List[int] = []
+
+
+class UserOut(BaseModel):
+    """Response model noting how many connections are held while it is validated."""
+    model_config = ConfigDict(from_attributes=True)
+
+    username: str
+
+    @field_validator("username")
+    @classmethod
+    def record_connections(cls, value):
+        held.append(len(database._connection_usage.get().open))  # pylint: disable=protected-access
+        return value
+
+
+def test_connection_is_returned_before_serialization(db):
+    crud.create_user(db, "a", "x")
+    app = FastAPI()
+    setup_metrics(app)
+
+    @app.get("/users", response_model=List[UserOut])
+    def list_users(session=Depends(database.get_db)):
+        return [crud.get_user_by_username(session, "a")]
+
+    labels = {"method": "GET", "endpoint": "/users"}
+    before = REGISTRY.get_sample_value("db_connection_hold_seconds_count", labels) or 0
+    held.clear()
+    response = TestClient(app).get("/users")
+    assert response.status_code == 200 and response.json()[0]["username"] == "a"
+    assert held == [0]
+    assert REGISTRY.get_sample_value("db_connection_hold_seconds_count", labels) == before + 1
+    assert REGISTRY.get_sample_value("db_connection_hold_seconds_sum", labels) > 0
@@ -0,0 +1,102 @@
+"""Tests for the streaming parsers and the batched upsert of the product import."""
+import asyncio
+import datetime
+
+from src.services import crud, models
+from src.services.importer import RowError, iter_batches, iter_csv, iter_ndjson, validate_row
+
+
+async def _chunks(data: bytes, size: int):
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
+
+
+def parse(parser, data: bytes, size: int = 7) -> list:
+    """Run a parser over ``data`` split into ``size``-byte chunks."""
+    async def collect():
+        return [item async for item in parser(_chunks(data, size))]
+    return asyncio.run(collect())
+
+
+def test_ndjson_rows():
+    data = (
+        b'{"id": 1, "title": "A", "price": 2.5, "published_date": "2020-01-02"}\n'
+        b'\n'
+        b'{"id": 2, "title": "B", "price": 3}\r\n'
+    )
+    assert parse(iter_ndjson, data) == [
+        (1, {"id": 1, "title": "A", "price": 2.5, "published_date": datetime.date(2020, 1, 2)}),
+        (3, {"id": 2, "title": "B", "price": 3.0}),
+    ]
+
+
+def test_ndjson_errors_do_not_stop_the_import():
+    data = b'{"id": 1, "title": "A", "price": 1}\nnot json\n[1, 2]\n{"id": "x", "title": "B", "price": 1}\n'
+    rows = parse(iter_ndjson, data)
+    assert rows[0] == (1, {"id": 1, "title": "A", "price": 1.0})
+    assert [line for line, row in rows[1:] if isinstance(row, RowError)] == [2, 3, 4]
+    assert "invalid JSON" in rows[1][1].message
+    assert "expected a JSON object" in rows[2][1].message
+    assert rows[3][1].message.startswith("id:")
+
+
+def test_ndjson_last_line_without_newline_and_multibyte_chunks():
+    data = '{"id": 1, "title": "Ăștia", "price": 1}'.encode()
+    assert parse(iter_ndjson, data, size=1) == [(1, {"id": 1, "title": "Ăștia", "price": 1.0})]
+
+
+def test_csv_rows():
+    data = (
+        b'\xef\xbb\xbfid,title,authors,price\n'
+        b'1,A,X,2.5\n'
+        b'2,B,,3\n'
+    )
+    assert parse(iter_csv, data) == [
+        (2, {"id": 1, "title": "A", "authors": "X", "price": 2.5}),
+        (3, {"id": 2, "title": "B", "price": 3.0}),
+    ]
+
+
+def test_csv_quoted_fields_spanning_lines():
+    data = b'id,title,description,price\n1,"A, b","line one\nline ""two""",4\n2,C,d,5\n'
+    assert parse(iter_csv, data, size=5) == [
+        (2, {"id": 1, "title": "A, b", "description": 'line one\nline "two"', "price": 4.0}),
+        (4, {"id": 2, "title": "C", "description": "d", "price": 5.0}),
+    ]
+
+
+def test_csv_errors():
+    data = b'id,title,price\n1,A\nx,B,1\n3,"open,1\n'
+    rows = parse(iter_csv, data)
+    assert all(isinstance(row, RowError) for _, row in rows)
+    assert [line for line, _ in rows] == [2, 3, 4]
+    assert rows[0][1].message == "expected 3 columns, got 2"
+    assert rows[2][1].message == "unterminated quoted field"
+
+
+def test_batches():
+    data = b"".join(b'{"id": %d, "title": "t", "price": 1}\n' % i for i in range(5)) + b"bad\n"
+
+    async def collect():
+        return [item async for item in iter_batches(iter_ndjson(_chunks(data, 16)), 2)]
+    batches = asyncio.run(collect())
+    assert [len(batch) for batch, _ in batches] == [2, 2, 1]
+    assert [len(errors) for _, errors in batches] == [0, 0, 1]
+
+
+def test_partial_rows_only_update_their_columns(db):
+    crud.upsert_products(db, [validate_row(1, {
+        "id": 1, "title": "A", "authors": "X", "description": "d",
+        "published_date": "2020-01-01", "price": "5",
+    })])
+    crud.upsert_products(db, [
+        validate_row(1, {"id": 1, "title": "A2", "authors": "", "price": "6"}),
+        validate_row(2, {"id": 2, "title": "B", "price": "7"}),
+    ])
+    first, second = (
+        db.query(models.Product).filter(models.Product.id == id_).populate_existing().one()
+        for id_ in (1, 2)
+    )
+    assert (first.title, first.price) == ("A2", 6.0)
+    assert (first.authors, first.description, first.published_date) == ("X", "d", datetime.date(2020, 1, 1))
+    assert (second.title, second.authors, second.description) == ("B", None, None)
@@ -0,0 +1,96 @@
+"""Tests for the order lookups and the incremental order aggregates."""
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event
+
+from src.services import crud, models
+
+
+@pytest.fixture
+def buyer(db):
+    user = crud.create_user(db, "buyer", "secret")
+    db.add_all([models.Product(id=1, title="A", price=10.0), models.Product(id=2, title="B", price=4.0)])
+    db.commit()
+    return user
+
+
+def test_aggregates_sum_the_slots(db, buyer, monkeypatch):
+    slots = iter(range(100))
+    monkeypatch.setattr(crud.random, "randrange", lambda count: next(slots) % count)
+    orders = [crud.create_order(db, user_id=buyer.id, product_id=product_id) for product_id in (1, 1, 2)]
+    crud.set_order_status(db, orders[0].id, "paid")
+    assert db.query(models.OrderAggregate).filter_by(dimension="status", key="created").count() == 4
+
+    expected = {
+        "product": [{"key": "1", "orders": 2, "revenue": 20.0}, {"key": "2", "orders": 1, "revenue": 4.0}],
+        "status": [
+            {"key": "created", "orders": 2, "revenue": 14.0},
+            {"key": "paid", "orders": 1, "revenue": 10.0},
+        ],
+    }
+    for dimension, rows in expected.items():
+        assert crud.get_order_aggregates(db, dimension) == rows
+    assert crud.get_order_aggregates(db, "status", limit=1, order_by="orders") == expected["status"][:1]
+
+    crud.rebuild_order_aggregates(db)
+    for dimension, rows in expected.items():
+        assert crud.get_order_aggregates(db, dimension) == rows
+
+
+def test_status_moves_use_the_order_amount(db, buyer):
+    order = crud.create_order(db, user_id=buyer.id, product_id=1)
+    db.query(models.Product).filter_by(id=1).update({"price": 99.0})
+    db.commit()
+    crud.set_order_status(db, order.id, "paid")
+    stats = {row["key"]: row["revenue"] for row in crud.get_order_aggregates(db, "status")}
+    assert stats == {"created": 0.0, "paid": 10.0}
+
+
+@pytest.fixture
+def statements(db):
+    """Record the SQL statements run on the test database."""
+    recorded = []
+    event.listen(
+        db.get_bind(), "before_cursor_execute",
+        lambda conn, cursor, statement, *args: recorded.append(statement),
+    )
+    return recorded
+
+
+def old_order(db, buyer, days):
+    order = models.Order(
+        user_id=buyer.id, product_id=1, status="created", amount=10.0,
+        created_at=datetime.utcnow() - timedelta(days=days),
+    )
+    db.add(order)
+    db.commit()
+    return order
+
+
+def test_recent_orders_are_found_in_the_hot_window(db, buyer, statements):
+    order = crud.create_order(db, user_id=buyer.id, product_id=1)
+    statements.clear()
+    assert crud.get_order(db, order.id).id == order.id
+    assert len(statements) == 1 and "created_at >=" in statements[0]
+
+
+def test_lookup_falls_back_to_the_history(db, buyer, statements):
+    order = old_order(db, buyer, days=400)
+    statements.clear()
+    assert crud.get_order(db, order.id).id == order.id
+    assert len(statements) == 2 and "created_at >=" not in statements[1]
+    assert crud.set_order_status(db, order.id, "paid") == "paid"
+
+
+def test_missing_orders(db, buyer):
+    assert crud.get_order(db, 12345) is None
+    assert crud.set_order_status(db, 12345, "paid") is None
+
+
+def test_listings_only_read_the_hot_window_by_default(db, buyer):
+    recent = crud.create_order(db, user_id=buyer.id, product_id=1)
+    old = old_order(db, buyer, days=400)
+    assert [order.id for order in crud.get_orders(db)] == [recent.id]
+    assert [order.id for order in crud.get_orders(db, history=True)] == [recent.id, old.id]
+    assert [order["id"] for order in crud.get_user_orders(db, buyer.id, history=True)] == [recent.id, old.id]
@@ -0,0 +1,278 @@
+"""Tests for the circuit breaker, the provider retries and the payment state machine."""
+import asyncio
+from datetime import datetime, timedelta
+
+import httpx
+import jwt
+import pytest
+from fastapi.testclient import TestClient
+
+from src import payment as payment_service
+from src.services import crud, models
+from src.services.payments import (
+    ChargeResult, CircuitBreaker, HttpPaymentProvider, PaymentProcessor, PaymentProvider,
+    ProviderUnavailable, TransientProviderError,
+)
+from src.shared.settings import get_settings
+
+
+class ScriptedProvider(PaymentProvider):
+    """Provider answering with the given results (or raising the given errors) in order."""
+
+    name = "scripted"
+
+    def __init__(self, *outcomes, retries=0, breaker=None):
+        super().__init__(retries=retries, backoff=0.0, breaker=breaker or CircuitBreaker(100, 60))
+        self.outcomes = list(outcomes)
+        self.calls = []
+
+    async def _charge_once(self, payment_id, amount, attempt):
+        self.calls.append((payment_id, amount, attempt))
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+def test_breaker_opens_after_the_threshold(clock):
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10)
+    breaker.record_failure()
+    assert breaker.state == "closed" and breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open" and not breaker.allow()
+
+
+def test_breaker_success_resets_the_failure_count(clock):
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == "closed"
+
+
+def test_breaker_lets_one_trial_through_when_half_open(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10)
+    breaker.record_failure()
+    clock.now += 10
+    assert breaker.state == "half_open"
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.allow()
+
+
+def test_breaker_reopens_when_the_trial_fails(clock):
+    breaker = CircuitBreaker(failure_threshold=5, reset_timeout=10)
+    for _ in range(5):
+        breaker.record_failure()
+    clock.now += 10
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    clock.now += 9
+    assert not breaker.allow()
+
+
+def test_charge_retries_transient_failures_with_the_same_attempt():
+    provider = ScriptedProvider(
+        TransientProviderError("timeout"), ChargeResult("succeeded", reference="r"), retries=2
+    )
+    result = asyncio.run(provider.charge(7, 10.0, attempt=3))
+    assert result.status == "succeeded"
+    assert provider.calls == [(7, 10.0, 3), (7, 10.0, 3)]
+
+
+def test_charge_gives_up_after_the_retries():
+    provider = ScriptedProvider(*[TransientProviderError("timeout")] * 3, retries=2)
+    with pytest.raises(ProviderUnavailable):
+        asyncio.run(provider.charge(7, 10.0))
+    assert len(provider.calls) == 3
+
+
+def test_charge_fails_fast_when_the_circuit_is_open(clock):
+    provider = ScriptedProvider(
+        TransientProviderError("down"), retries=3, breaker=CircuitBreaker(1, 60)
+    )
+    with pytest.raises(ProviderUnavailable, match="Circuit breaker open"):
+        asyncio.run(provider.charge(7, 10.0))
+    assert len(provider.calls) == 1
+
+
+@pytest.fixture
+def order(db):
+    user = crud.create_user(db, "buyer", "secret")
+    db.add(models.Product(id=1, title="Book", price=10.0))
+    db.commit()
+    return crud.create_order(db, user_id=user.id, product_id=1)
+
+
+def process(payment_id, provider):
+    processor = PaymentProcessor(workers=1, queue_size=10, sweep_interval=60)
+    processor.provider = provider
+    asyncio.run(processor.process(payment_id))
+
+
+def fresh(db, model, id_):
+    return db.query(model).filter(model.id == id_).populate_existing().one()
+
+
+def test_successful_payment_marks_the_order_paid(db, order):
+    payment = crud.create_payment(db, order_id=order.id, amount=order.amount)
+    provider = ScriptedProvider(ChargeResult("succeeded", reference="ref-1"))
+    process(payment.id, provider)
+    payment = fresh(db, models.Payment, payment.id)
+    assert (payment.status, payment.provider_reference) == ("succeeded", "ref-1")
+    assert fresh(db, models.Order, order.id).status == "paid"
+    assert provider.calls == [(payment.id, 10.0, 1)]
+    stats = {row["key"]: row for row in crud.get_order_aggregates(db, "status")}
+    assert stats["paid"]["revenue"] == 10.0 and stats["created"]["revenue"] == 0.0
+
+
+def test_declined_payment_fails_and_keeps_the_order(db, order):
+    payment = crud.create_payment(db, order_id=order.id, amount=order.amount)
+    process(payment.id, ScriptedProvider(ChargeResult("failed", error="declined")))
+    payment = fresh(db, models.Payment, payment.id)
+    assert (payment.status, payment.error) == ("failed", "declined")
+    assert fresh(db, models.Order, order.id).status == "created"
+
+
+def test_provider_outage_puts_the_payment_back_to_pending(db, order):
+    payment = crud.create_payment(db, order_id=order.id, amount=order.amount)
+    process(payment.id, ScriptedProvider(TransientProviderError("down")))
+    payment = fresh(db, models.Payment, payment.id)
+    assert payment.status == "pending"
+    assert "down" in payment.error
+
+
+def test_pending_provider_answer_waits_for_the_webhook(db, order):
+    payment = crud.create_payment(db, order_id=order.id, amount=order.amount)
+    process(payment.id, ScriptedProvider(ChargeResult("pending", reference="ref-2")))
+    payment = fresh(db, models.Payment, payment.id)
+    assert (payment.status, payment.provider_reference) == ("processing", "ref-2")
+    crud.set_payment_status(db, payment.id, "succeeded")
+    assert fresh(db, models.Order, order.id).status == "paid"
+
+
+def test_only_pending_payments_are_processed(db, order):
+    payment = crud.create_payment(db, order_id=order.id, amount=order.amount)
+    assert crud.claim_payment(db, payment.id)
+    provider = ScriptedProvider()
+    process(payment.id, provider)
+    assert provider.calls == []
+    assert not crud.claim_payment(db, payment.id)
+
+
+def test_retrying_a_failed_payment_starts_a_new_attempt(db, order):
+    payment = crud.create_payment(db, order_id=order.id, amount=order.amount)
+    provider = ScriptedProvider(
+        ChargeResult("failed", error="declined"), ChargeResult("succeeded", reference="ref-3")
+    )
+    process(payment.id, provider)
+    retried = crud.retry_payment(db, payment.id)
+    assert (retried.status, retried.attempt, retried.error) == ("pending", 2, None)
+    assert crud.retry_payment(db, payment.id) is None
+    process(payment.id, provider)
+    assert [attempt for _, _, attempt in provider.calls] == [1, 2]
+    assert fresh(db, models.Payment, payment.id).status == "succeeded"
+
+
+def test_order_and_payment_are_updated_in_one_transaction(db, order, monkeypatch):
+    payment = crud.create_payment(db, order_id=order.id, amount=order.amount)
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("aggregates unavailable")
+    monkeypatch.setattr(crud, "_update_order_aggregates", fail)
+    with pytest.raises(RuntimeError):
+        crud.set_payment_status(db, payment.id, "succeeded")
+    assert fresh(db, models.Payment, payment.id).status == "pending"
+    assert fresh(db, models.Order, order.id).status == "created"
+
+
+def test_sweep_requeues_stale_processing_payments(db, order):
+    payment = crud.create_payment(db, order_id=order.id, amount=order.amount)
+    crud.claim_payment(db, payment.id)
+    assert crud.requeue_stale_payments(db, datetime.utcnow() - timedelta(minutes=1)) == []
+    assert crud.requeue_stale_payments(db, datetime.utcnow() + timedelta(minutes=1)) == [payment.id]
+    assert fresh(db, models.Payment, payment.id).status == "pending"
+
+
+def test_unexpected_error_in_the_trial_reopens_the_circuit(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10)
+    provider = ScriptedProvider(
+        TransientProviderError("down"), ValueError("bad body"), ChargeResult("succeeded", reference="r"),
+        breaker=breaker,
+    )
+    with pytest.raises(ProviderUnavailable):
+        asyncio.run(provider.charge(7, 10.0))
+    clock.now += 10
+    with pytest.raises(ValueError):
+        asyncio.run(provider.charge(7, 10.0))
+    assert breaker.state == "open" and not breaker.trial_in_flight
+    clock.now += 10
+    assert asyncio.run(provider.charge(7, 10.0)).status == "succeeded"
+    assert breaker.state == "closed"
+
+
+def http_provider(handler, retries=0):
+    provider = HttpPaymentProvider(
+        "http://provider", "key", timeout=1, max_connections=1,
+        retries=retries, backoff=0.0, breaker=CircuitBreaker(100, 60),
+    )
+    provider.client = httpx.AsyncClient(base_url="http://provider", transport=httpx.MockTransport(handler))
+    return provider
+
+
+def test_http_provider_sends_the_attempt_idempotency_key():
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        return httpx.Response(200, json={"id": "ch_1", "status": "succeeded"})
+    result = asyncio.run(http_provider(handler).charge(7, 10.0, attempt=2))
+    assert (result.status, result.reference) == ("succeeded", "ch_1")
+    assert requests[0].headers["Idempotency-Key"] == "payment-7-2"
+
+
+@pytest.mark.parametrize("response", [
+    httpx.Response(200, content=b"<html>"),
+    httpx.Response(200, json=["succeeded"]),
+    httpx.Response(200, json={"status": "weird"}),
+    httpx.Response(503),
+])
+def test_http_provider_treats_bad_responses_as_transient(response):
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return response
+    with pytest.raises(ProviderUnavailable):
+        asyncio.run(http_provider(handler, retries=1).charge(7, 10.0))
+    assert len(calls) == 2
+
+
+def test_http_provider_declines_on_client_errors():
+    result = asyncio.run(http_provider(lambda request: httpx.Response(402, text="no funds")).charge(7, 10.0))
+    assert result.status == "failed" and "402" in result.error
+
+
+def test_concurrent_payment_requests_return_the_same_payment(db, order, monkeypatch):
+    submitted = []
+    monkeypatch.setattr(payment_service.processor, "full", lambda: False)
+    monkeypatch.setattr(payment_service.processor, "submit", submitted.append)
+    # The concurrent request created the payment between the check and the insert
+    first = crud.create_payment(db, order_id=order.id, amount=order.amount)
+    get_payment_by_order = crud.get_payment_by_order
+    lookups = []
+
+    def stale_first_lookup(session, order_id):
+        lookups.append(order_id)
+        return None if len(lookups) == 1 else get_payment_by_order(session, order_id=order_id)
+    monkeypatch.setattr(crud, "get_payment_by_order", stale_first_lookup)
+    settings = get_settings()
+    token = jwt.encode({"sub": "buyer", "role": "user"}, settings.secret_key, algorithm=settings.algorithm)
+    response = TestClient(payment_service.app).post(
+        "/", json={"order_id": order.id}, headers={"Authorization": f"Bearer {token}"}
+    )
+    assert response.status_code == 202
+    assert response.json()["payment_id"] == first.id
+    assert submitted == [] and len(lookups) == 2
@@ -0,0 +1,92 @@
+"""Tests for the bloom filter and the in-memory token revocation cache."""
+import asyncio
+import time
+from datetime import datetime, timedelta
+
+from src.services import models
+from src.shared.revocation import BloomFilter, RevocationCache
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = BloomFilter(1000, 0.01)
+    for i in range(1000):
+        bloom.add(f"jti-{i}")
+    assert all(f"jti-{i}" in bloom for i in range(1000))
+    assert bloom.count == 1000
+
+
+def test_bloom_filter_false_positive_rate():
+    bloom = BloomFilter(1000, 0.01)
+    for i in range(1000):
+        bloom.add(f"jti-{i}")
+    false_positives = sum(f"other-{i}" in bloom for i in range(20000))
+    assert false_positives / 20000 < 0.03
+
+
+def test_empty_bloom_filter_contains_nothing():
+    bloom = BloomFilter(10, 0.01)
+    assert "anything" not in bloom
+
+
+def test_revoked_token_ids():
+    cache = RevocationCache(capacity=10)
+    cache.revoke_token("a", time.time() + 60)
+    assert cache.is_revoked({"sub": "u", "jti": "a"})
+    assert not cache.is_revoked({"sub": "u", "jti": "b"})
+    assert not cache.is_revoked({"sub": "u"})
+
+
+def test_revoked_users():
+    cache = RevocationCache(capacity=10)
+    now = time.time()
+    cache.revoke_user("u", now)
+    assert cache.is_revoked({"sub": "u", "iat": now - 1})
+    assert not cache.is_revoked({"sub": "u", "iat": now + 1})
+    assert not cache.is_revoked({"sub": "v", "iat": now - 1})
+
+
+def test_bloom_filter_grows_with_the_revocations():
+    cache = RevocationCache(capacity=4)
+    for i in range(20):
+        cache.revoke_token(f"jti-{i}", time.time() + 60)
+    assert cache.bloom.capacity >= 20
+    assert all(cache.is_revoked({"jti": f"jti-{i}"}) for i in range(20))
+
+
+def test_prune_forgets_expired_tokens():
+    cache = RevocationCache(capacity=10)
+    cache.revoke_token("old", time.time() - 1)
+    cache.revoke_token("new", time.time() + 60)
+    cache.prune()
+    assert not cache.is_revoked({"jti": "old"})
+    assert cache.is_revoked({"jti": "new"})
+
+
+def add_revocation(db, id_, jti, created_at=None):
+    db.add(models.TokenRevocation(
+        id=id_, jti=jti, created_at=created_at or datetime.utcnow(),
+        expires_at=datetime.utcnow() + timedelta(hours=1),
+    ))
+    db.commit()
+
+
+def test_first_load_skips_the_expired_history(db):
+    old = datetime.utcnow() - timedelta(days=30)
+    for id_ in range(1, 4):
+        add_revocation(db, id_, f"old-{id_}", created_at=old)
+    cache = RevocationCache(capacity=10)
+    asyncio.run(cache.refresh())
+    assert cache.last_id == 3 and not cache.revoked
+
+
+def test_refresh_sees_rows_committed_out_of_order(db):
+    cache = RevocationCache(capacity=10)
+    add_revocation(db, 1, "a")
+    add_revocation(db, 3, "c")
+    asyncio.run(cache.refresh())
+    assert cache.last_id == 3
+    # Id 2 was assigned before id 3 but committed after the refresh
+    add_revocation(db, 2, "b")
+    asyncio.run(cache.refresh())
+    assert cache.is_revoked({"jti": "b"})
+    assert cache.bloom.count == 3
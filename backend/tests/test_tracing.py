@@ -0,0 +1,104 @@
+"""Tests for the W3C trace context, the sampling decision and the recorded spans."""
+import pytest
+from fastapi.testclient import TestClient
+
+from src import product
+from src.shared import tracing
+from src.shared.tracing import parse_traceparent
+
+TRACE_ID = "4bf92f3577b34da6a3ce929d0e0e4736"
+PARENT_ID = "00f067aa0ba902b7"
+
+
+def test_parse_traceparent_sampled():
+    assert parse_traceparent(f"00-{TRACE_ID}-{PARENT_ID}-01") == (TRACE_ID, PARENT_ID, True)
+
+
+def test_parse_traceparent_not_sampled():
+    assert parse_traceparent(f"00-{TRACE_ID}-{PARENT_ID}-00") == (TRACE_ID, PARENT_ID, False)
+
+
+def test_parse_traceparent_normalizes_case_and_whitespace():
+    value = f"  00-{TRACE_ID.upper()}-{PARENT_ID.upper()}-01 "
+    assert parse_traceparent(value) == (TRACE_ID, PARENT_ID, True)
+
+
+def test_parse_traceparent_accepts_future_versions():
+    assert parse_traceparent(f"01-{TRACE_ID}-{PARENT_ID}-01-extra") == (TRACE_ID, PARENT_ID, True)
+
+
+@pytest.mark.parametrize("value", [
+    None,
+    "",
+    "garbage",
+    f"ff-{TRACE_ID}-{PARENT_ID}-01",
+    f"0-{TRACE_ID}-{PARENT_ID}-01",
+    f"00-{TRACE_ID[:-1]}-{PARENT_ID}-01",
+    f"00-{TRACE_ID}-{PARENT_ID}0-01",
+    f"00-{TRACE_ID}-{PARENT_ID}-1",
+    f"00-{'z' * 32}-{PARENT_ID}-01",
+    f"00-{TRACE_ID}-{PARENT_ID}-zz",
+    f"00-{'0' * 32}-{PARENT_ID}-01",
+    f"00-{TRACE_ID}-{'0' * 16}-01",
+])
+def test_parse_traceparent_rejects_invalid(value):
+    assert parse_traceparent(value) is None
+
+
+def test_sampling_follows_the_ratio(monkeypatch):
+    monkeypatch.setattr(tracing, "TRACE_SAMPLE_RATIO", 0.5)
+    assert tracing._sample_new_trace("f" * 16 + "0" * 16)
+    assert tracing._sample_new_trace("0" * 16 + "7" + "f" * 15)
+    assert not tracing._sample_new_trace("0" * 16 + "8" + "0" * 15)
+
+
+def test_sampling_disabled_and_always(monkeypatch):
+    monkeypatch.setattr(tracing, "TRACE_SAMPLE_RATIO", 0.0)
+    assert not tracing._sample_new_trace("0" * 32)
+    monkeypatch.setattr(tracing, "TRACE_SAMPLE_RATIO", 1.0)
+    assert tracing._sample_new_trace("f" * 32)
+
+
+def test_sampling_is_consistent_across_services(monkeypatch):
+    monkeypatch.setattr(tracing, "TRACE_SAMPLE_RATIO", 0.3)
+    assert {tracing._sample_new_trace(TRACE_ID) for _ in range(10)} == {tracing._sample_new_trace(TRACE_ID)}
+
+
+@pytest.fixture
+def spans(monkeypatch):
+    """Record the finished spans in memory."""
+    exporter = tracing.InMemoryExporter()
+    monkeypatch.setattr(tracing, "exporter", exporter)
+    return exporter.spans
+
+
+def test_request_spans(db, spans):
+    client = TestClient(product.app)
+    response = client.get("/search?q=book", headers={"traceparent": f"00-{TRACE_ID}-{PARENT_ID}-01"})
+    assert response.status_code == 200
+    trace_id, span_id, sampled = parse_traceparent(response.headers["traceparent"])
+    assert (trace_id, sampled) == (TRACE_ID, True)
+
+    by_name = {span["name"]: span for span in spans}
+    server = by_name["GET /search"]
+    assert server["span_id"] == span_id and server["parent_id"] == PARENT_ID
+    assert server["kind"] == "server" and server["attributes"]["http.status_code"] == 200
+    assert server["attributes"]["http.route"] == "/search"
+    crud_span = by_name["crud.get_products"]
+    assert crud_span["parent_id"] == server["span_id"]
+    queries = [span for span in spans if span["name"] == "db.query"]
+    assert queries and all(span["parent_id"] == crud_span["span_id"] for span in queries)
+    assert "FROM products" in queries[0]["attributes"]["db.statement"]
+    assert {span["trace_id"] for span in spans} == {TRACE_ID}
+
+    metrics = client.get("/metrics", headers={"Accept": "application/openmetrics-text"}).text
+    assert f'trace_id="{TRACE_ID}"' in metrics
+
+
+def test_unsampled_request_records_nothing(db, spans, monkeypatch):
+    monkeypatch.setattr(tracing, "TRACE_SAMPLE_RATIO", 0.0)
+    client = TestClient(product.app)
+    response = client.get("/search?q=book", headers={"traceparent": f"00-{TRACE_ID}-{PARENT_ID}-00"})
+    assert response.status_code == 200 and "traceparent" not in response.headers
+    assert client.get("/search?q=book").status_code == 200
+    assert not spans
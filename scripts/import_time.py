@@ -0,0 +1,73 @@
+"""Measure how long importing each backend service takes.
+
+Every measurement runs in a fresh interpreter, the way a new replica starts,
+so module caches from earlier runs do not hide regressions. Importing a
+service must not need the database: run this without Postgres available.
+
+Usage:
+    python scripts/import_time.py [--runs N] [--detail SERVICE]
+
+``--detail`` prints the 15 slowest modules of one service (``-X importtime``).
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend")
+SERVICES = ("auth", "product", "orders", "payment", "database", "monolith")
+
+
+def time_import(module: str) -> float:
+    """Import ``module`` in a new interpreter and return the elapsed seconds."""
+    code = f"import time; t = time.perf_counter(); import {module}; print(time.perf_counter() - t)"
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=BACKEND_DIR, capture_output=True, text=True, check=True,
+    )
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def slowest_modules(module: str, count: int = 15) -> list:
+    """Return the ``count`` modules with the highest cumulative import time."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=BACKEND_DIR, capture_output=True, text=True, check=True,
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        # import time: self [us] | cumulative | imported package
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        rows.append((int(cumulative_us), int(self_us), name.rstrip()))
+    return sorted(rows, reverse=True)[:count]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--runs", type=int, default=5, help="imports per service")
+    parser.add_argument("--detail", choices=SERVICES, help="show the slowest modules of a service")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    print(f"{'service':<10} {'median':>10} {'min':>10} {'max':>10}")
+    for service in SERVICES:
+        timings = [time_import(f"src.{service}") for _ in range(args.runs)]
+        print(
+            f"{service:<10} {statistics.median(timings) * 1000:>8.1f}ms"
+            f" {min(timings) * 1000:>8.1f}ms {max(timings) * 1000:>8.1f}ms"
+        )
+
+    if args.detail:
+        print(f"\nSlowest modules imported by {args.detail} (cumulative / self):")
+        for cumulative_us, self_us, name in slowest_modules(f"src.{args.detail}"):
+            print(f"{cumulative_us / 1000:>9.1f}ms {self_us / 1000:>9.1f}ms  {name}")
+
+    print(f"\nTotal benchmark time: {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()